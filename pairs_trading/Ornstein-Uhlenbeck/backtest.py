@@ -0,0 +1,339 @@
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from multiprocessing import shared_memory
+import os
+import warnings
+
+from typing import *
+
+
+# Read-only views of the shared leg price and z-score arrays in each worker
+_shared = {}
+
+
+def simulate(dependent: np.ndarray,
+             independent: np.ndarray,
+             beta: np.ndarray,
+             zscores: np.ndarray,
+             entry: float = 2.0,
+             exit: float = 0.5,
+             dependent_cost=0.0,
+             independent_cost=0.0):
+    """
+    Simulates a mean-reversion strategy on every pair at once. A pair
+    goes short the spread when its z-score rises above entry and long
+    when it falls below -entry. Shorts are closed once the z-score is back
+    below exit, longs once it is back above -exit. Positions are taken at
+    the close of the signal bar and earn from the next bar on.
+
+    A long spread holds one share of the dependent leg and -beta shares of
+    the independent leg, scaled at entry so that the gross value of both
+    legs is one unit of capital per pair.
+
+    Returns TxP arrays of dependent shares, independent shares and net
+    profit and loss per bar.
+
+    :param dependent: A TxP array of dependent leg prices.
+    :param independent: A TxP array of independent leg prices.
+    :param beta: An array of the P hedge ratios.
+    :param zscores: A TxP array of spread z-scores. NaN z-scores neither
+        open nor close positions.
+    :param entry: A float to denote the z-score that opens a position.
+    :param exit: A float to denote the z-score that closes a position.
+    :param dependent_cost: A float, or an array of P floats, to denote the
+        cost of trading the dependent leg as a fraction of traded value.
+    :param independent_cost: Like dependent_cost for the independent leg.
+    """
+
+    n_obs, n_pairs = zscores.shape
+    state = np.zeros(n_pairs)  # +1 long spread, -1 short spread, 0 flat
+    units = np.zeros(n_pairs)  # Spread units bought with unit capital
+    dependent_shares = np.zeros((n_obs, n_pairs))
+    independent_shares = np.zeros((n_obs, n_pairs))
+
+    for t in range(n_obs):
+        z = zscores[t]
+
+        position = state.copy()
+        position[(state == -1) & (z <= exit)] = 0
+        position[(state == 1) & (z >= -exit)] = 0
+        position[z > entry] = -1
+        position[z < -entry] = 1
+
+        # Size new positions at this bar's prices
+        opened = (position != 0) & (position != state)
+        units[opened] = 1/(dependent[t, opened] +
+                           np.abs(beta[opened])*independent[t, opened])
+
+        state = position
+        dependent_shares[t] = state*units
+        independent_shares[t] = -state*units*beta
+
+    # Profit of shares held over each bar, less costs of trades at its close
+    pnl = np.zeros((n_obs, n_pairs))
+    pnl[1:] = (dependent_shares[:-1]*np.diff(dependent, axis=0) +
+               independent_shares[:-1]*np.diff(independent, axis=0))
+
+    traded_dependent = np.abs(np.diff(dependent_shares, axis=0,
+                                      prepend=0.0))*dependent
+    traded_independent = np.abs(np.diff(independent_shares, axis=0,
+                                        prepend=0.0))*independent
+    pnl -= (traded_dependent*dependent_cost +
+            traded_independent*independent_cost)
+
+    return dependent_shares, independent_shares, pnl
+
+
+def backtest(prices: pd.DataFrame,
+             hedge_ratios: pd.DataFrame,
+             zscores,
+             entry: float = 2.0,
+             exit: float = 0.5,
+             costs=0.0):
+    """
+    Backtests every pair of hedge_ratios on its z-scores with
+    simulate(). Each pair is given one unit of capital and the portfolio
+    holds equal capital in every pair.
+
+    For pairs of a fitted OpticsPairs instance:
+        op.calc_rolling_zscores()
+        pairs = op.zscore_windows.index
+        backtest(op.prices, op.hedge_ratios.loc[pairs],
+                 op.rolling_zscores[0])
+
+    :param prices: pd.DataFrame of security prices with dimensions TxN.
+    :param hedge_ratios: pd.DataFrame with columns dependent,
+        independent and beta, e.g. OpticsPairs.hedge_ratios, with one row
+        per pair.
+    :param zscores: A TxP array like object of spread z-scores aligned
+        with prices and the rows of hedge_ratios.
+    :param entry: A float to denote the z-score that opens a position.
+        Default value is 2.0.
+    :param exit: A float to denote the z-score that closes a position.
+        Default value is 0.5.
+    :param costs: A float, or pd.Series indexed by security, to denote the
+        cost of trading a leg as a fraction of traded value.
+        Default value is 0.0.
+
+    Returns a TxP dataframe of pair equity curves, a series of the
+    portfolio equity curve and a TxP dataframe of spread positions.
+    """
+
+    dependent, independent, beta, dependent_cost, independent_cost = \
+        _legs(prices, hedge_ratios, costs)
+    zscores = np.asarray(zscores, dtype=float)
+
+    if zscores.shape != dependent.shape:
+        raise ValueError("zscores must have one row per bar and one column \
+                         per pair of hedge_ratios")
+
+    dependent_shares, _, pnl = simulate(dependent, independent, beta,
+                                        zscores, entry, exit,
+                                        dependent_cost, independent_cost)
+
+    pair_equity = pd.DataFrame(1 + pnl.cumsum(axis=0), index=prices.index,
+                               columns=hedge_ratios.index)
+    portfolio_equity = pair_equity.mean(axis=1)
+    positions = pd.DataFrame(np.sign(dependent_shares), index=prices.index,
+                             columns=hedge_ratios.index)
+
+    return pair_equity, portfolio_equity, positions
+
+
+def summarize(equity: pd.Series, trading_year: float = 252.0) -> Dict:
+    """
+    Returns the total return, annualized Sharpe ratio and maximum
+    drawdown of an equity curve.
+
+    :param equity: pd.Series of equity values starting from 1.
+    :param trading_year: A float to denote the number of bars per year.
+        Default value is 252.0.
+    """
+
+    values = np.asarray(equity, dtype=float)
+    returns = np.diff(values)/values[:-1]
+
+    std = returns.std()
+    sharpe = (np.sqrt(trading_year)*returns.mean()/std if std > 0
+              else np.nan)
+
+    peak = np.maximum.accumulate(values)
+    drawdown = 1 - values/peak
+
+    return {'total_return': values[-1]/values[0] - 1,
+            'sharpe': sharpe,
+            'max_drawdown': drawdown.max()}
+
+
+def _legs(prices: pd.DataFrame, hedge_ratios: pd.DataFrame, costs):
+    """
+    Returns TxP arrays of the leg prices of every pair, their betas and
+    the cost of each leg.
+    """
+
+    dependent = prices[hedge_ratios['dependent']].values.astype(float)
+    independent = prices[hedge_ratios['independent']].values.astype(float)
+    beta = hedge_ratios['beta'].values.astype(float)
+
+    if isinstance(costs, pd.Series):
+        dependent_cost = costs.loc[hedge_ratios['dependent']].values
+        independent_cost = costs.loc[hedge_ratios['independent']].values
+    else:
+        dependent_cost = independent_cost = costs
+
+    return dependent, independent, beta, dependent_cost, independent_cost
+
+
+def _attach_shared(names: List[str], shape: tuple, n_lookbacks: int):
+    """
+    Worker initializer. Attaches to the shared memory blocks created by
+    grid_search and keeps read-only views of them.
+    """
+
+    shapes = [shape, shape, (n_lookbacks,) + shape]
+    for key, name, block_shape in zip(['dependent', 'independent',
+                                       'zscores'], names, shapes):
+        shm = shared_memory.SharedMemory(name=name)
+        values = np.ndarray(block_shape, dtype=np.float64, buffer=shm.buf)
+        values.flags.writeable = False
+        _shared[key + '_shm'] = shm
+        _shared[key] = values
+
+
+def _run_shared_params(params: dict, beta: np.ndarray, costs: tuple,
+                       trading_year: float):
+    """
+    Runs one parameter set on the shared arrays.
+    """
+
+    return _run_params(_shared['dependent'], _shared['independent'],
+                       _shared['zscores'], params, beta, costs, trading_year)
+
+
+def _run_params(dependent: np.ndarray,
+                independent: np.ndarray,
+                zscores: np.ndarray,
+                params: dict,
+                beta: np.ndarray,
+                costs: tuple,
+                trading_year: float):
+    """
+    Simulates every pair with one parameter set and summarizes the
+    portfolio equity curve.
+    """
+
+    dependent_shares, _, pnl = simulate(
+        dependent, independent, beta, zscores[params['lookback']],
+        params['entry'], params['exit'], *costs)
+
+    portfolio_equity = 1 + pnl.sum(axis=1).cumsum()/pnl.shape[1]
+    summary = summarize(portfolio_equity, trading_year)
+
+    # Count trades as bars where a pair opens a position
+    position = np.sign(dependent_shares)
+    summary['n_trades'] = int(((position != 0) &
+                               (np.diff(position, axis=0, prepend=0.0) != 0)
+                               ).sum())
+
+    return summary
+
+
+def grid_search(prices: pd.DataFrame,
+                hedge_ratios: pd.DataFrame,
+                zscores,
+                entries=(1.5, 2.0, 2.5),
+                exits=(0.0, 0.5),
+                costs=0.0,
+                n_jobs: int = 1,
+                trading_year: float = 252.0) -> pd.DataFrame:
+    """
+    Backtests the portfolio of pairs for every combination of lookback,
+    entry and exit threshold.
+
+    With n_jobs > 1 the leg prices and z-scores are placed in shared
+    memory once and every worker process simulates its parameter sets
+    from the same read-only buffers.
+
+    :param prices: pd.DataFrame of security prices with dimensions TxN.
+    :param hedge_ratios: pd.DataFrame with columns dependent,
+        independent and beta, with one row per pair.
+    :param zscores: A TxP array of z-scores, or a KxTxP array with one
+        layer per lookback, e.g. OpticsPairs.rolling_zscores.
+    :param entries: An iterable of entry z-scores.
+    :param exits: An iterable of exit z-scores.
+    :param costs: A float, or pd.Series indexed by security, to denote the
+        cost of trading a leg as a fraction of traded value.
+    :param n_jobs: An integer to denote the number of worker processes.
+        -1 uses all available cores. Default value is 1 (serial).
+    :param trading_year: A float to denote the number of bars per year.
+
+    Returns a dataframe with one row per parameter set, with its lookback
+    layer, entry, exit, total return, Sharpe ratio, maximum drawdown and
+    number of trades.
+    """
+
+    dependent, independent, beta, dependent_cost, independent_cost = \
+        _legs(prices, hedge_ratios, costs)
+    costs = (dependent_cost, independent_cost)
+
+    zscores = np.asarray(zscores, dtype=np.float64)
+    if zscores.ndim == 2:
+        zscores = zscores[np.newaxis]
+
+    if zscores.shape[1:] != dependent.shape:
+        raise ValueError("zscores must have one row per bar and one column \
+                         per pair of hedge_ratios")
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+
+    grid = [{'lookback': lookback, 'entry': entry, 'exit': exit}
+            for lookback, entry, exit in product(range(len(zscores)),
+                                                 entries, exits)
+            if exit < entry]
+
+    results = [None]*len(grid)
+
+    if n_jobs == 1:
+        for i, params in enumerate(grid):
+            results[i] = _run_params(dependent, independent, zscores,
+                                     params, beta, costs, trading_year)
+    else:
+        blocks = []
+        try:
+            # Copy arrays into shared memory once for all workers
+            for values in [dependent, independent, zscores]:
+                values = np.ascontiguousarray(values, dtype=np.float64)
+                shm = shared_memory.SharedMemory(create=True,
+                                                 size=max(values.nbytes, 1))
+                np.ndarray(values.shape, dtype=np.float64,
+                           buffer=shm.buf)[:] = values
+                blocks.append(shm)
+
+            with ProcessPoolExecutor(
+                    max_workers=n_jobs,
+                    initializer=_attach_shared,
+                    initargs=([shm.name for shm in blocks],
+                              dependent.shape, len(zscores))) as executor:
+                futures = [executor.submit(_run_shared_params, params, beta,
+                                           costs, trading_year)
+                           for params in grid]
+
+                for i, future in enumerate(futures):
+                    try:
+                        results[i] = future.result()
+                    except Exception as e:
+                        warnings.warn(f"Parameters {grid[i]} failed: {e!r}")
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+    rows = [dict(params, **result)
+            for params, result in zip(grid, results) if result is not None]
+
+    return pd.DataFrame(rows, columns=['lookback', 'entry', 'exit',
+                                       'total_return', 'sharpe',
+                                       'max_drawdown', 'n_trades'])
@@ -0,0 +1,92 @@
+'''
+Benchmark of OpticsPairs clustering backends
+---
+Fits each backend of OpticsPairs.cluster() to synthetic security loadings
+of growing universe size and reports wall time and peak traced memory.
+Loadings are drawn around a few cluster centres in component space, like
+the PCA loadings that OpticsPairs.find_pairs() clusters.
+
+Usage:
+    python benchmark_clustering.py --sizes 250 500 1000 2000 4000
+'''
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from mlpairs import OpticsPairs
+
+
+BACKENDS = {
+    'optics_auto': {'algorithm': 'auto'},
+    'optics_brute': {'algorithm': 'brute'},
+    'optics_kd_tree': {'algorithm': 'kd_tree'},
+    'knn_graph': {'algorithm': 'knn_graph'},
+    'ann': {'algorithm': 'ann'},
+}
+
+
+def make_loadings(n_securities: int,
+                  n_components: int = 10,
+                  n_clusters: int = 20,
+                  seed: int = 42) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(0, 1, (n_clusters, n_components))
+    labels = rng.integers(0, n_clusters, n_securities)
+    loadings = centres[labels] + rng.normal(0, 0.1,
+                                            (n_securities, n_components))
+    # Scale like PCA loadings, which are unit-norm per component
+    return loadings/np.sqrt(n_securities)
+
+
+def run_backend(loadings: np.ndarray, n_jobs: int, params: dict):
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    fitted = OpticsPairs.cluster(loadings, n_jobs=n_jobs, **params)
+
+    wall_time = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    n_clusters = len(set(fitted.labels_) - {-1})
+
+    return wall_time, peak, n_clusters
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[250, 500, 1000, 2000, 4000])
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS))
+    parser.add_argument("--n_jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    rows = []
+    for n_securities in args.sizes:
+        loadings = make_loadings(n_securities)
+        for backend in args.backends:
+            try:
+                wall_time, peak, n_clusters = run_backend(
+                    loadings, args.n_jobs, BACKENDS[backend])
+            except ImportError as e:
+                print(f"Skipping {backend}: {e}")
+                continue
+
+            rows.append({'n_securities': n_securities,
+                         'backend': backend,
+                         'wall_time_s': round(wall_time, 3),
+                         'peak_memory_mb': round(peak/2**20, 1),
+                         'n_clusters': n_clusters})
+            print(rows[-1])
+
+    results = pd.DataFrame(rows)
+    print(results.pivot(index='n_securities', columns='backend',
+                        values=['wall_time_s', 'peak_memory_mb']))
+
+
+if __name__ == "__main__":
+    main()
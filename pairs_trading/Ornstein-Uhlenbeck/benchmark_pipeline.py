@@ -0,0 +1,120 @@
+'''
+Benchmark of the OpticsPairs pipeline
+---
+Runs every OpticsPairs stage with profiling enabled on synthetic universes
+of growing size and reports wall time, CPU time and item counts per stage.
+With --memory, a second run traces peak memory per stage with tracemalloc.
+Timings always come from the untraced run, since tracing slows
+allocations down. Save the results of a release with --output and compare
+them against the next release to catch regressions.
+
+Prices follow a factor model: securities in the same group load on the
+same random-walk factor plus an AR(1) idiosyncratic term, so clusters and
+cointegrated pairs exist at every size.
+
+Usage:
+    python benchmark_pipeline.py --sizes 50 100 250 500 1000 2000
+    python benchmark_pipeline.py --output bench.csv --eg_lag series --memory
+'''
+
+import argparse
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+
+from mlpairs import OpticsPairs
+
+
+def make_prices(n_securities: int,
+                n_obs: int = 500,
+                group_size: int = 10,
+                seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    n_groups = max(1, n_securities//group_size)
+
+    factors = np.cumsum(rng.normal(0, 1, (n_obs, n_groups)), axis=0)
+    groups = rng.integers(0, n_groups, n_securities)
+    loadings = rng.uniform(0.5, 1.5, n_securities)
+
+    # AR(1) idiosyncratic term keeps spreads mean reverting
+    noise = rng.normal(0, 0.5, (n_obs, n_securities))
+    for t in range(1, n_obs):
+        noise[t] += 0.8*noise[t - 1]
+
+    prices = 100 + factors[:, groups]*loadings + noise
+    index = pd.date_range("2020-01-01", periods=n_obs, freq="D")
+    columns = [f"SEC{i}" for i in range(n_securities)]
+
+    return pd.DataFrame(prices, index=index, columns=columns)
+
+
+def run_pipeline(prices: pd.DataFrame,
+                 args,
+                 profile_memory: bool = False) -> pd.DataFrame:
+    op = OpticsPairs(prices, profile=True, profile_memory=profile_memory)
+
+    eg_lag = args.eg_lag
+    if eg_lag is not None and eg_lag != 'series':
+        eg_lag = int(eg_lag)
+
+    # Stages print progress, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        op.reduce_PCA(args.n_components)
+        op.find_pairs()
+        op.calc_eg_norm_spreads(n_jobs=args.n_jobs, eg_lag=eg_lag)
+        op.calc_hurst_exponents()
+        op.calc_half_lives()
+        op.calc_avg_cross_count()
+        op.filter_pairs()
+
+    return op.profile_report()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[50, 100, 250, 500, 1000, 2000])
+    parser.add_argument("--n_obs", type=int, default=500)
+    parser.add_argument("--n_components", type=int, default=5)
+    parser.add_argument("--n_jobs", type=int, default=1)
+    parser.add_argument("--eg_lag", default=None,
+                        help="None, an integer lag or 'series'")
+    parser.add_argument("--memory", action="store_true",
+                        help="Trace peak memory per stage in a second run")
+    parser.add_argument("--output", default=None,
+                        help="Optional path of a csv file for the results")
+    args = parser.parse_args()
+
+    reports = []
+    for n_securities in args.sizes:
+        prices = make_prices(n_securities, args.n_obs)
+        report = run_pipeline(prices, args)
+        if args.memory:
+            traced = run_pipeline(prices, args, profile_memory=True)
+            report['peak_memory_mb'] = traced['peak_memory_mb'].values
+        reports.append(report)
+
+        total = report[['wall_time_s', 'cpu_time_s']].sum()
+        print(f"{n_securities} securities: "
+              f"{total['wall_time_s']:.2f}s wall, "
+              f"{total['cpu_time_s']:.2f}s cpu, "
+              f"{report['n_items'].iloc[-1]} pairs selected")
+
+    results = pd.concat(reports, ignore_index=True)
+
+    with pd.option_context("display.width", 200,
+                           "display.max_columns", 20):
+        print(results.pivot(index='n_securities', columns='stage',
+                            values='wall_time_s'))
+        if args.memory:
+            print(results.pivot(index='n_securities', columns='stage',
+                                values='peak_memory_mb'))
+
+    if args.output is not None:
+        results.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
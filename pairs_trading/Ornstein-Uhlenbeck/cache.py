@@ -0,0 +1,123 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+
+from typing import *
+import numpy as np
+
+
+logger = logging.getLogger()
+
+
+class PairCache:
+    """
+    Content-addressed store of pair test results in a local SQLite file.
+
+    Keys are hashes of the data and parameters a result was computed from,
+    so a result is reused whenever the same pair, price window and test
+    parameters come up again, in this run or in another process. Values
+    are small JSON documents. Once the stored keys and values exceed
+    max_bytes, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str = "data/pair_cache.db",
+                 max_bytes: int = 256 * 2**20):
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path, timeout=30)
+        # Write-ahead logging lets parallel notebooks read while one writes
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS results_last_access "
+            "ON results (last_access)")
+        self.conn.commit()
+
+    @staticmethod
+    def fingerprint(values: np.ndarray) -> str:
+        values = np.ascontiguousarray(values)
+        digest = hashlib.sha1(str((values.shape, values.dtype.str)).encode())
+        digest.update(values.tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict]:
+
+        found = dict()
+
+        # Stay below SQLite's limit on query parameters
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, value FROM results WHERE key IN ({placeholders})",
+                chunk).fetchall()
+            found.update({key: json.loads(value) for key, value in rows})
+
+        if len(found) > 0:
+            now = time.time()
+            self.conn.executemany(
+                "UPDATE results SET last_access = ? WHERE key = ?",
+                [(now, key) for key in found])
+            self.conn.commit()
+
+        logger.info("Pair cache: %s of %s results found",
+                    len(found), len(keys))
+
+        return found
+
+    def put_many(self, items: Dict[str, Dict]):
+
+        if len(items) == 0:
+            return
+
+        now = time.time()
+        rows = []
+        for key, value in items.items():
+            value = json.dumps(value)
+            rows.append((key, value, len(key) + len(value), now))
+
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO results (key, value, size, last_access) "
+            "VALUES (?, ?, ?, ?)", rows)
+        self.conn.commit()
+
+        self.evict()
+
+    def evict(self):
+
+        total = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+        if total <= self.max_bytes:
+            return
+
+        # Walk entries from least recently used until under the cap
+        excess = total - self.max_bytes
+        cursor = self.conn.execute(
+            "SELECT key, size FROM results ORDER BY last_access")
+        evicted = []
+        for key, size in cursor:
+            evicted.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+
+        self.conn.executemany("DELETE FROM results WHERE key = ?", evicted)
+        self.conn.commit()
+
+        logger.info("Pair cache: evicted %s results", len(evicted))
+
+    def clear(self):
+        self.conn.execute("DELETE FROM results")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
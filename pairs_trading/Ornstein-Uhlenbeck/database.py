@@ -6,66 +6,425 @@ from typing import *
 import numpy as np
 import pandas as pd
 
+from utils import TF_EQUIV, TF_MS
+
 
 logger = logging.getLogger()
 
+COLUMNS = ["timestamp", "open", "high", "low", "close", "volume", "bidPrice", "askPrice"]
+
 
 class Hdf5Client:
-    def __init__(self, exchange: str):
+    """
+    Stores candles of each symbol in a group with one chunked, optionally
+    compressed, float64 dataset per column: timestamp, open, high, low,
+    close, volume, bidPrice and askPrice. Queries read only the columns
+    they ask for. Rows are kept sorted by timestamp, so time ranges are
+    located with a binary search instead of a full read.
+
+    Each group also keeps its first and last timestamp, row count and
+    gaps between candles as attributes, updated on every write, so range
+    checks do not read the data.
+
+    Higher timeframes are materialized as rollups in {symbol}/rollups/{tf}
+    groups of the same layout and updated on every write, from the first
+    bucket the write touched, so get_data(..., tf="1h") reads precomputed
+    bars. Buckets are aligned to the epoch and only buckets with candles
+    are stored.
+
+    Symbols stored in the older (N, 8) dataset layout are converted the
+    first time they are accessed. migrate_hdf5.py converts a whole file at
+    once and reclaims its space.
+    """
+
+    def __init__(self, exchange: str, interval: int = 60000,
+                 chunk_rows: int = 10080, compression: str = None,
+                 compression_opts: int = None,
+                 rollups: Iterable[str] = None):
+        """
+        :param exchange: Name of the exchange, stored in data/{exchange}.h5.
+        :param interval: Expected milliseconds between candles. Spacings
+            above it are counted as gaps. Default is 60000 (1m candles).
+        :param chunk_rows: Number of rows per chunk of new datasets.
+            Default is 10080 (one week of 1m candles). Rollups use chunks
+            of the same time span, with at least 256 rows.
+        :param compression: Compression filter of new datasets, "gzip",
+            "lzf" or None. Default is None.
+        :param compression_opts: Compression level for "gzip" (0-9).
+        :param rollups: Timeframes of TF_EQUIV kept as rollups of every
+            symbol. Default is every timeframe above 1m. Rollups already
+            stored, or built by a get_data query, are also kept updated.
+        """
+
+        if rollups is None:
+            rollups = [tf for tf in TF_EQUIV if tf != "1m"]
+        self._check_timeframes(rollups)
+
+        self.interval = interval
+        self.chunk_rows = chunk_rows
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.rollups = list(rollups)
         self.hf = h5py.File(f"data/{exchange}.h5", "a")
         self.hf.flush()
 
     def create_dataset(self, symbol: str):
         if symbol not in self.hf.keys():
-            self.hf.create_dataset(
-                symbol, (0, 8), maxshape=(None, 8), dtype="float64")
+            self._create_group(symbol)
             self.hf.flush()
 
+    def _create_group(self, name: str, interval: int = None, chunk_rows: int = None) -> h5py.Group:
+
+        group = self.hf.create_group(name)
+        group.attrs["interval"] = self.interval if interval is None else interval
+
+        for column in COLUMNS:
+            group.create_dataset(
+                column, (0,), maxshape=(None,), dtype="float64",
+                chunks=(self.chunk_rows if chunk_rows is None else chunk_rows,),
+                compression=self.compression,
+                compression_opts=self.compression_opts,
+                shuffle=self.compression is not None)
+
+        self._reset_metadata(group)
+
+        return group
+
+    def _ensure_layout(self, symbol: str) -> h5py.Group:
+        """
+        Returns the group of a symbol, first converting an (N, 8) dataset
+        of the older layout to sorted column datasets.
+        """
+
+        node = self.hf[symbol]
+
+        if isinstance(node, h5py.Group):
+            return node
+
+        logger.info("%s: Converting %s rows to column layout",
+                    symbol, node.shape[0])
+
+        # Build the new group beside the old dataset before replacing it
+        temp = f"{symbol}__migrating"
+        if temp in self.hf:
+            del self.hf[temp]
+        self._create_group(temp)
+        self._write(temp, node[:])
+
+        del self.hf[symbol]
+        self.hf.move(temp, symbol)
+        self.hf.flush()
+
+        return self.hf[symbol]
+
+    def _reset_metadata(self, group: h5py.Group):
+        """
+        Recalculates the metadata attributes of a group from all of its
+        timestamps.
+        """
+
+        timestamps = group["timestamp"][:]
+        interval = group.attrs.get("interval", self.interval)
+
+        group.attrs["interval"] = interval
+        group.attrs["n_rows"] = len(timestamps)
+        group.attrs["first_ts"] = timestamps[0] if len(timestamps) else np.nan
+        group.attrs["last_ts"] = timestamps[-1] if len(timestamps) else np.nan
+        group.attrs["n_gaps"], group.attrs["max_gap"] = \
+            self._gaps(timestamps, interval)
+
+    @staticmethod
+    def _gaps(timestamps: np.ndarray, interval: float) -> Tuple[int, float]:
+        """
+        Returns the number of spacings above interval between consecutive
+        sorted timestamps and the largest spacing, 0 without gaps.
+        """
+
+        spacing = np.diff(timestamps)
+        gaps = spacing[spacing > interval]
+
+        return len(gaps), (gaps.max() if len(gaps) else 0.0)
+
+    def _update_metadata(self, group: h5py.Group, old_ts: np.ndarray, new_ts: np.ndarray):
+        """
+        Updates the metadata attributes after the rows from some position
+        to the end of a group were rewritten. old_ts and new_ts are the
+        timestamps of that region before and after the write, each led by
+        the timestamp of the row just before it if there is one. Only the
+        region is inspected, unless the largest gap was inside it and got
+        filled, in which case the gaps are recounted from all rows.
+        """
+
+        attrs = group.attrs
+        interval = attrs["interval"]
+
+        old_gaps, old_max = self._gaps(old_ts, interval)
+        new_gaps, new_max = self._gaps(new_ts, interval)
+
+        attrs["n_rows"] = group["timestamp"].shape[0]
+        attrs["first_ts"] = group["timestamp"][0]
+        attrs["last_ts"] = new_ts[-1]
+
+        if old_max < attrs["max_gap"] or new_max >= old_max:
+            attrs["n_gaps"] = attrs["n_gaps"] - old_gaps + new_gaps
+            attrs["max_gap"] = max(attrs["max_gap"], new_max)
+        else:
+            self._reset_metadata(group)
+
+    @staticmethod
+    def _search(timestamps: h5py.Dataset, timestamp: float, side: str = "left") -> int:
+        """
+        Binary search over a sorted timestamp dataset, like
+        np.searchsorted. Reads one value per step, so the cost is
+        O(log N) small reads.
+        """
+
+        low, high = 0, timestamps.shape[0]
+
+        while low < high:
+            mid = (low + high) // 2
+            ts = timestamps[mid]
+            if ts < timestamp or (side == "right" and ts == timestamp):
+                low = mid + 1
+            else:
+                high = mid
+
+        return low
+
+    @staticmethod
+    def _read(group: h5py.Group, start: int, stop: int = None, columns: List[str] = COLUMNS) -> np.ndarray:
+        """
+        Returns rows start:stop of the given columns of a group as a 2D
+        array, reading only those column datasets.
+        """
+
+        return np.column_stack([group[column][start:stop]
+                                for column in columns])
+
+    @staticmethod
+    def _set_rows(group: h5py.Group, start: int, rows: np.ndarray):
+        """
+        Writes rows from position start to the end of every column of a
+        group, resizing the columns to fit.
+        """
+
+        for i, column in enumerate(COLUMNS):
+            dataset = group[column]
+            dataset.resize(start + len(rows), axis=0)
+            dataset[start:] = rows[:, i]
+
     def write_data(self, symbol: str, data: List[Tuple]):
 
-        min_ts, max_ts = self.get_first_last_timestamp(symbol)
+        if self._write(symbol, data):
+            self.hf.flush()
+
+    def write_many(self, data: Dict[str, List[Tuple]]):
+        """
+        Writes candles of several symbols, creating missing datasets, and
+        flushes the file once at the end.
+
+        :param data: Dictionary of candle rows per symbol.
+        """
+
+        written = False
+
+        for symbol, rows in data.items():
+            self.create_dataset(symbol)
+            written = self._write(symbol, rows) or written
+
+        if written:
+            self.hf.flush()
 
-        if min_ts is None:
-            min_ts = float("inf")
-            max_ts = 0
+    def _write(self, symbol: str, data: List[Tuple]) -> bool:
+        """
+        Merges candles into the sorted columns of a symbol without
+        flushing. Rows whose timestamp is already stored, or repeated in
+        data, are dropped, so stored rows are never overwritten. New rows
+        may fall before, inside or after the stored history. Only stored
+        rows from the first new timestamp onwards are read and rewritten,
+        so appends cost O(log N) and backfilling a recent gap only moves
+        the rows after it. Rollups are then updated from the bucket of the
+        first new row. Returns whether any row was written.
+        """
+
+        group = self._ensure_layout(symbol)
+
+        data_array = np.array(data, dtype="float64").reshape(-1, 8)
+
+        # Sort the batch and keep the first row of each timestamp
+        _, first = np.unique(data_array[:, 0], return_index=True)
+        data_array = data_array[first]
+
+        if len(data_array) == 0:
+            logger.warning("%s: No data to insert", symbol)
+            return False
 
-        filtered_data = []
+        timestamps = group["timestamp"]
+        n_rows = timestamps.shape[0]
+        if n_rows > 0 and data_array[0, 0] > group.attrs["last_ts"]:
+            start = n_rows  # Append, no search needed
+        else:
+            start = self._search(timestamps, data_array[0, 0], "left")
+        stored = self._read(group, start)
 
-        for d in data:
-            if d[0] < min_ts:
-                filtered_data.append(d)
-            elif d[0] > max_ts:
-                filtered_data.append(d)
+        data_array = data_array[~np.isin(data_array[:, 0], stored[:, 0])]
 
-        if len(filtered_data) == 0:
+        if len(data_array) == 0:
             logger.warning("%s: No data to insert", symbol)
+            return False
+
+        merged = np.concatenate([stored, data_array])
+        merged = merged[np.argsort(merged[:, 0], kind="stable")]
+
+        self._set_rows(group, start, merged)
+
+        previous = timestamps[start - 1:start] if start > 0 else np.empty(0)
+        self._update_metadata(group,
+                              np.concatenate([previous, stored[:, 0]]),
+                              np.concatenate([previous, merged[:, 0]]))
+
+        levels = set(self.rollups)
+        if "rollups" in group:
+            levels |= set(group["rollups"].keys())
+        self._update_rollups(group, levels, data_array[0, 0])
+
+        return True
+
+    @staticmethod
+    def _check_timeframes(timeframes: Iterable[str]):
+
+        unknown = set(timeframes) - set(TF_EQUIV)
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown timeframes {sorted(unknown)}: "
+                             f"must be in {list(TF_EQUIV)}")
+
+    def _rollup(self, group: h5py.Group, tf: str) -> h5py.Group:
+        """
+        Returns the rollup group of a timeframe, building it from all
+        candles of the symbol the first time it is requested.
+        """
+
+        if f"rollups/{tf}" not in group:
+            self._update_rollups(group, [tf], -np.inf)
+            self.hf.flush()
+
+        return group[f"rollups/{tf}"]
+
+    def _update_rollups(self, group: h5py.Group, levels: Iterable[str], from_ts: float):
+        """
+        Recalculates the bars of rollups from the bucket of from_ts
+        onwards, building missing rollups from all candles. Candles are
+        read once, from the start of the longest bucket touched, so an
+        append only reads the candles of its current day.
+        """
+
+        buckets = dict()
+        for tf in levels:
+            if f"rollups/{tf}" not in group:
+                # Same time span per chunk as the candles, at least 256 rows
+                chunk_rows = max(256, int(self.chunk_rows * group.attrs["interval"] // TF_MS[tf]))
+                self._create_group(f"{group.name}/rollups/{tf}",
+                                   interval=TF_MS[tf], chunk_rows=chunk_rows)
+                buckets[tf] = -np.inf
+            else:
+                buckets[tf] = from_ts // TF_MS[tf] * TF_MS[tf]
+
+        if len(buckets) == 0:
             return
 
-        data_array = np.array(filtered_data)
+        offset = self._search(group["timestamp"], min(buckets.values()))
+        candles = self._read(group, offset)
 
-        self.hf[symbol].resize(self.hf[symbol].shape[0] +
-                               data_array.shape[0], axis=0)
-        self.hf[symbol][-data_array.shape[0]:] = data_array
+        for tf, bucket in buckets.items():
+            bars = self._aggregate(candles[candles[:, 0] >= bucket], TF_MS[tf])
 
-        self.hf.flush()
+            if len(bars) == 0:
+                continue
+
+            rollup = group[f"rollups/{tf}"]
+            timestamps = rollup["timestamp"]
+            n_bars = timestamps.shape[0]
+            last_ts = rollup.attrs["last_ts"]
+
+            # Appends only touch the last bar
+            if n_bars > 0 and bars[0, 0] >= last_ts:
+                start = n_bars - 1 if bars[0, 0] == last_ts else n_bars
+            else:
+                start = self._search(timestamps, bars[0, 0], "left")
+            stored = timestamps[start:]
+
+            self._set_rows(rollup, start, bars)
+
+            previous = timestamps[start - 1:start] if start > 0 else np.empty(0)
+            self._update_metadata(rollup,
+                                  np.concatenate([previous, stored]),
+                                  np.concatenate([previous, bars[:, 0]]))
+
+    @staticmethod
+    def _aggregate(candles: np.ndarray, ms: int) -> np.ndarray:
+        """
+        Aggregates sorted candles into bars of ms milliseconds like
+        utils.resample_timeframe: first open, highest high, lowest low,
+        last close, summed volume and last bid and ask. Each bar is
+        stamped with the start of its bucket.
+        """
 
-    def get_data(self, symbol: str, from_time: int, to_time: int) -> Union[None, pd.DataFrame]:
+        if len(candles) == 0:
+            return np.empty((0, len(COLUMNS)))
+
+        buckets = candles[:, 0] // ms * ms
+        first = np.flatnonzero(np.r_[True, np.diff(buckets) > 0])
+        last = np.r_[first[1:] - 1, len(candles) - 1]
+
+        return np.column_stack([
+            buckets[first],
+            candles[first, 1],
+            np.maximum.reduceat(candles[:, 2], first),
+            np.minimum.reduceat(candles[:, 3], first),
+            candles[last, 4],
+            np.add.reduceat(candles[:, 5], first),
+            candles[last, 6],
+            candles[last, 7]])
+
+    def get_data(self, symbol: str, from_time: int, to_time: int,
+                 columns: List[str] = None, tf: str = "1m") -> Union[None, pd.DataFrame]:
+        """
+        Returns candles of a symbol from from_time to to_time inclusive,
+        indexed by time.
+
+        :param columns: Optional list of columns to read, e.g. ["close"].
+            Only those columns are read from disk. Default reads all.
+        :param tf: Timeframe of TF_EQUIV. Timeframes above 1m are read from
+            the materialized rollup, with bars stamped at the start of
+            their bucket. Default is "1m".
+        """
 
         start_query = time.time()
 
-        existing_data = self.hf[symbol][:]
+        if columns is None:
+            columns = COLUMNS[1:]
 
-        if len(existing_data) == 0:
-            return None
+        unknown = set(columns) - set(COLUMNS[1:])
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown columns {sorted(unknown)}: "
+                             f"must be in {COLUMNS[1:]}")
 
-        data = sorted(existing_data, key=lambda x: x[0])
-        data = np.array(data)
+        self._check_timeframes([tf])
 
-        df = pd.DataFrame(
-            data, columns=["timestamp", "open", "high", "low", "close", "volume", "bidPrice", "askPrice"])
+        group = self._ensure_layout(symbol)
+        if tf != "1m":
+            group = self._rollup(group, tf)
+        timestamps = group["timestamp"]
 
-        df = df[((df["timestamp"]) >= from_time)
-                & (df["timestamp"] <= to_time)]
+        if timestamps.shape[0] == 0:
+            return None
+
+        # Read only the rows between from_time and to_time inclusive
+        start = self._search(timestamps, from_time, "left")
+        stop = self._search(timestamps, to_time, "right")
+        data = self._read(group, start, stop, ["timestamp"] + list(columns))
+
+        df = pd.DataFrame(data, columns=["timestamp"] + list(columns))
 
         df["timestamp"] = pd.to_datetime(
             df["timestamp"].values.astype(np.int64), unit="ms")
@@ -82,12 +441,22 @@ class Hdf5Client:
 
     def get_first_last_timestamp(self, symbol: str) -> Union[Tuple[None, None], Tuple[float, float]]:
 
-        existing_data = self.hf[symbol][:]
+        attrs = self._ensure_layout(symbol).attrs
 
-        if len(existing_data) == 0:
+        if attrs["n_rows"] == 0:
             return None, None
 
-        first_ts = min(existing_data, key=lambda x: x[0])[0]
-        last_ts = max(existing_data, key=lambda x: x[0])[0]
+        return attrs["first_ts"], attrs["last_ts"]
+
+    def get_metadata(self, symbol: str) -> Dict[str, float]:
+        """
+        Returns the first and last timestamp, row count, expected interval,
+        number of gaps and largest gap of a symbol without reading its
+        rows.
+        """
+
+        attrs = self._ensure_layout(symbol).attrs
 
-        return first_ts, last_ts
+        return {key: attrs[key]
+                for key in ["first_ts", "last_ts", "n_rows", "interval",
+                            "n_gaps", "max_gap"]}
@@ -0,0 +1,201 @@
+import pandas as pd
+import numpy as np
+
+from typing import *
+
+
+class KalmanHedge:
+    """
+    Recursive Kalman-filter estimator of dynamic hedge ratios for many
+    pairs at once.
+
+    The state of each pair is its (beta, alpha), which follows a random
+    walk and is observed through y = beta*x + alpha + e. Every bar updates
+    the state, its 2x2 covariance and the spread variance of all pairs
+    with a fixed number of array operations, so the cost per bar does not
+    depend on the length of history.
+    """
+
+    def __init__(self,
+                 hedge_ratios: pd.DataFrame,
+                 delta: float = 1e-4,
+                 observation_var=1.0,
+                 state_cov: np.ndarray = None):
+        """
+        :param hedge_ratios: pd.DataFrame with columns dependent,
+            independent, alpha and beta, e.g. OpticsPairs.hedge_ratios.
+            alpha and beta are the starting state of each pair.
+        :param delta: A float to denote how fast hedge ratios may drift.
+            The state noise covariance is delta/(1 - delta) times the
+            identity. Default value is 1e-4.
+        :param observation_var: A float, or an array with one value per
+            pair, to denote the variance of the spread around the fitted
+            hedge. Default value is 1.0.
+        :param state_cov: Optional Px2x2 array of the starting covariance
+            of (beta, alpha). Default is the identity for every pair.
+        """
+
+        self.pairs = hedge_ratios.index
+        self.dependent = hedge_ratios['dependent'].values
+        self.independent = hedge_ratios['independent'].values
+        self.securities = pd.Index(
+            np.union1d(self.dependent, self.independent))
+        self._dependent_idx = self.securities.get_indexer(self.dependent)
+        self._independent_idx = self.securities.get_indexer(self.independent)
+
+        n_pairs = len(hedge_ratios)
+        self.delta = delta
+        self.observation_var = np.broadcast_to(
+            np.asarray(observation_var, dtype=float), (n_pairs,)).copy()
+
+        # State (beta, alpha) per pair and its covariance
+        self.state = np.column_stack(
+            [hedge_ratios['beta'].values.astype(float),
+             hedge_ratios['alpha'].values.astype(float)])
+        if state_cov is None:
+            state_cov = np.tile(np.eye(2), (n_pairs, 1, 1))
+        self.state_cov = np.array(state_cov, dtype=float)
+
+        self.spread = np.full(n_pairs, np.nan)  # Latest prediction error
+        self.spread_var = np.full(n_pairs, np.nan)  # Its predicted variance
+        self.zscore = np.full(n_pairs, np.nan)
+
+    @property
+    def beta(self):
+        return self.state[:, 0]
+
+    @property
+    def alpha(self):
+        return self.state[:, 1]
+
+    @classmethod
+    def from_optics_pairs(cls, op, pairs=None, delta: float = 1e-4):
+        """
+        Creates a filter warm-started from the OLS fits of a fitted
+        OpticsPairs instance. Each pair starts at its OLS alpha and beta,
+        with the OLS residual variance as observation variance and the OLS
+        parameter covariance as state covariance.
+
+        :param op: OpticsPairs instance after .calc_eg_norm_spreads() or
+            .filter_pairs_staged().
+        :param pairs: Optional index of pair labels to track. Default is
+            op.filtered_pairs.index, or every pair if pairs are not
+            filtered yet.
+        :param delta: A float to denote how fast hedge ratios may drift.
+            Default value is 1e-4.
+        """
+
+        if op.hedge_ratios is None:
+            raise ValueError("hedge_ratios not found: must run \
+                             .calc_eg_norm_spreads() before this function")
+
+        if pairs is None:
+            pairs = (op.hedge_ratios.index if op.filtered_pairs is None
+                     else op.filtered_pairs.index)
+
+        hedge_ratios = op.hedge_ratios.loc[pairs]
+        y = op.prices[hedge_ratios['dependent']].values
+        x = op.prices[hedge_ratios['independent']].values
+        beta = hedge_ratios['beta'].values
+        alpha = hedge_ratios['alpha'].values
+
+        # Residual variance and (X'X)^-1 of the OLS fit y = beta*x + alpha
+        n_obs = len(x)
+        observation_var = (
+            (y - (alpha + beta*x))**2).sum(axis=0)/(n_obs - 2)
+
+        sum_x = x.sum(axis=0)
+        sum_xx = (x**2).sum(axis=0)
+        det = n_obs*sum_xx - sum_x**2
+        xtx_inv = np.empty((len(hedge_ratios), 2, 2))
+        xtx_inv[:, 0, 0] = n_obs/det
+        xtx_inv[:, 0, 1] = xtx_inv[:, 1, 0] = -sum_x/det
+        xtx_inv[:, 1, 1] = sum_xx/det
+
+        return cls(hedge_ratios,
+                   delta=delta,
+                   observation_var=observation_var,
+                   state_cov=observation_var[:, np.newaxis, np.newaxis] *
+                   xtx_inv)
+
+    def update(self, prices: pd.Series):
+        """
+        Updates hedge ratios, spreads and spread variances of every pair
+        with one bar of prices. Pairs missing a leg price keep their
+        state. Returns the z-scores of the prediction errors, which are
+        the spreads under the hedge ratios known before the bar.
+
+        :param prices: pd.Series of prices indexed by security.
+        """
+
+        values = prices.reindex(self.securities).values.astype(float)
+
+        return self._update(values[self._dependent_idx],
+                            values[self._independent_idx])
+
+    def run(self, prices: pd.DataFrame):
+        """
+        Runs the filter over a dataframe of prices, one row per bar, and
+        returns TxP arrays of beta, alpha, spread and spread variance after
+        each bar.
+
+        :param prices: pd.DataFrame with a column for every leg.
+        """
+
+        y = prices[self.dependent].values.astype(float)
+        x = prices[self.independent].values.astype(float)
+
+        n_obs, n_pairs = y.shape
+        beta = np.empty((n_obs, n_pairs))
+        alpha = np.empty((n_obs, n_pairs))
+        spread = np.empty((n_obs, n_pairs))
+        spread_var = np.empty((n_obs, n_pairs))
+
+        for t in range(n_obs):
+            self._update(y[t], x[t])
+            beta[t], alpha[t] = self.state.T
+            spread[t] = self.spread
+            spread_var[t] = self.spread_var
+
+        return beta, alpha, spread, spread_var
+
+    def hedge_ratios(self) -> pd.DataFrame:
+        """
+        Returns the current hedge ratios in the layout of
+        OpticsPairs.hedge_ratios.
+        """
+
+        return pd.DataFrame({'dependent': self.dependent,
+                             'independent': self.independent,
+                             'alpha': self.alpha,
+                             'beta': self.beta},
+                            index=self.pairs)
+
+    def _update(self, y: np.ndarray, x: np.ndarray):
+
+        valid = ~(np.isnan(y) | np.isnan(x))
+        state = self.state[valid]
+        cov = self.state_cov[valid]
+        y, x = y[valid], x[valid]
+
+        # Predict: the state is a random walk
+        cov = cov + self.delta/(1 - self.delta)*np.eye(2)
+
+        # Observation row h = (x, 1)
+        h = np.column_stack([x, np.ones_like(x)])
+        error = y - (h*state).sum(axis=1)
+        cov_h = np.einsum('pij,pj->pi', cov, h)
+        error_var = (h*cov_h).sum(axis=1) + self.observation_var[valid]
+
+        # Correct state and covariance with the Kalman gain
+        gain = cov_h/error_var[:, np.newaxis]
+        state = state + gain*error[:, np.newaxis]
+        cov = cov - gain[:, :, np.newaxis]*cov_h[:, np.newaxis, :]
+
+        self.state[valid] = state
+        self.state_cov[valid] = cov
+        self.spread[valid] = error
+        self.spread_var[valid] = error_var
+        self.zscore[valid] = error/np.sqrt(error_var)
+
+        return self.zscore
@@ -0,0 +1,84 @@
+'''
+Migration of Hdf5Client files to the column layout
+---
+Rewrites data/{exchange}.h5 into a new file where every symbol is a group
+of chunked, optionally compressed, column datasets sorted by timestamp.
+Symbols already in the column layout are copied as they are. Writing a
+new file, rather than converting in place, also returns the space of the
+old datasets, which HDF5 does not reclaim on delete. Rollups are rebuilt
+from the candles with chunks scaled to their timeframe, so rerunning the
+migration also shrinks files whose rollups were written with full-size
+chunks. The original file is kept as data/{exchange}.h5.bak.
+
+Usage:
+    python migrate_hdf5.py --exchange binance --compression gzip
+'''
+
+import argparse
+import os
+
+import h5py
+
+from database import Hdf5Client
+
+
+def migrate(exchange: str,
+            chunk_rows: int = 10080,
+            compression: str = None,
+            compression_opts: int = None):
+
+    source_path = f"data/{exchange}.h5"
+    target_name = f"{exchange}.migrating"
+    target_path = f"data/{target_name}.h5"
+
+    if os.path.exists(target_path):
+        os.remove(target_path)
+
+    source = h5py.File(source_path, "r")
+    target = Hdf5Client(target_name,
+                        chunk_rows=chunk_rows,
+                        compression=compression,
+                        compression_opts=compression_opts)
+
+    interval = target.interval
+
+    try:
+        for symbol in source.keys():
+            node = source[symbol]
+
+            if isinstance(node, h5py.Dataset):
+                rows = node[:]
+            else:
+                rows = Hdf5Client._read(node, 0)
+
+            # Keep the candle interval of symbols that recorded one
+            target.interval = node.attrs.get("interval", interval)
+            target.create_dataset(symbol)
+            target.write_data(symbol, rows)
+            print(f"{symbol}: {len(rows)} rows")
+    finally:
+        source.close()
+        target.hf.close()
+
+    os.replace(source_path, source_path + ".bak")
+    os.replace(target_path, source_path)
+
+    print(f"{source_path}: {os.path.getsize(source_path + '.bak')/2**20:.1f} MB "
+          f"-> {os.path.getsize(source_path)/2**20:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--exchange", required=True)
+    parser.add_argument("--chunk_rows", type=int, default=10080)
+    parser.add_argument("--compression", choices=["gzip", "lzf"],
+                        default=None)
+    parser.add_argument("--compression_opts", type=int, default=None)
+    args = parser.parse_args()
+
+    migrate(args.exchange, args.chunk_rows, args.compression,
+            args.compression_opts)
+
+
+if __name__ == "__main__":
+    main()
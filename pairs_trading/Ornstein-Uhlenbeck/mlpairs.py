@@ -2,16 +2,124 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
+from sklearn.base import clone
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import FunctionTransformer, StandardScaler
-from sklearn.decomposition import PCA
-from sklearn.cluster import OPTICS
+from sklearn.decomposition import PCA, IncrementalPCA
+from sklearn.cluster import OPTICS, cluster_optics_xi, cluster_optics_dbscan
+from sklearn.neighbors import NearestNeighbors
+from scipy import sparse
 import statsmodels.api as sm
 import statsmodels.tsa.stattools as ts
+from statsmodels.tsa.adfvalues import mackinnonp
 from itertools import combinations, chain
+from cache import PairCache
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import json
+import os
+import time
+import tracemalloc
 import warnings
 
 
+def _profiled(count_items):
+    """
+    Decorator for OpticsPairs stages. When profiling is enabled, records
+    wall time, CPU time of this process and the number of items the stage
+    produced in self.profile_records, and passes the record to
+    self.profile_callback. Peak memory is only traced with tracemalloc if
+    self.profile_memory is set, since tracing slows allocations down and
+    inflates the timings. It is NaN otherwise.
+
+    :param count_items: A function of the OpticsPairs instance returning
+        the number of items after the stage ran.
+    """
+
+    def decorator(method):
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.profile:
+                return method(self, *args, **kwargs)
+
+            peak_memory = np.nan
+            if self.profile_memory:
+                tracing = tracemalloc.is_tracing()
+                if tracing:
+                    tracemalloc.reset_peak()
+                else:
+                    tracemalloc.start()
+                start_memory = tracemalloc.get_traced_memory()[0]
+            start_wall = time.perf_counter()
+            start_cpu = time.process_time()
+
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                wall_time = time.perf_counter() - start_wall
+                cpu_time = time.process_time() - start_cpu
+                if self.profile_memory:
+                    peak_memory = (tracemalloc.get_traced_memory()[1] -
+                                   start_memory)/2**20
+                    if not tracing:
+                        tracemalloc.stop()
+
+            record = {'stage': method.__name__,
+                      'wall_time_s': wall_time,
+                      'cpu_time_s': cpu_time,
+                      'peak_memory_mb': peak_memory,
+                      'n_securities': len(self.securities),
+                      'n_obs': len(self.prices),
+                      'n_items': count_items(self)}
+            self.profile_records.append(record)
+            if self.profile_callback is not None:
+                self.profile_callback(record)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def _n_pairs(op):
+    return 0 if op.pairs is None else len(op.pairs)
+
+
+def _n_spreads(op):
+    return 0 if op.norm_spreads is None else op.norm_spreads.shape[1]
+
+
+def _n_filtered(op):
+    return 0 if op.filtered_pairs is None else len(op.filtered_pairs)
+
+
+def _eg_test_chunk(prices: np.ndarray,
+                   pair_idx: np.ndarray,
+                   lags: np.ndarray = None):
+    """
+    Runs the Engle-Granger test for a chunk of pairs. Defined at module level
+    so it can be pickled by a process pool.
+
+    :param prices: A TxM array containing the price columns used by the chunk.
+    :param pair_idx: A Kx2 integer array of column positions in prices.
+    :param lags: An optional integer array of length K with a fixed ADF lag
+        order per pair. If None, lags are chosen by AIC through ts.coint.
+    """
+
+    pvalues = np.empty(len(pair_idx))
+    flipped = np.empty(len(pair_idx), dtype=bool)
+
+    for i, (idx_0, idx_1) in enumerate(pair_idx):
+        lag = None if lags is None else int(lags[i])
+        pvalues[i], flipped[i] = OpticsPairs.eg_test(prices[:, idx_0],
+                                                     prices[:, idx_1],
+                                                     lag)
+
+    return pvalues, flipped
+
+
 class OpticsPairs:
     """
     This class implements the pairs selection framework outlined in
@@ -32,36 +140,127 @@ class OpticsPairs:
     implementation requirements.
     """
 
-    def __init__(self, data: pd.DataFrame):
+    # Statistics stored column by column in statistics.npy
+    _SAVED_STATISTICS = ['engle_granger_tests', 'hurst_exponents',
+                         'half_lives', 'avg_cross_count']
+
+    def __init__(self,
+                 data: pd.DataFrame,
+                 spread_dtype=np.float64,
+                 spread_path: str = None,
+                 block_size: int = 256,
+                 cache: PairCache = None,
+                 returns: pd.DataFrame = None,
+                 profile: bool = False,
+                 profile_memory: bool = False,
+                 profile_callback=None):
         """
-        Initializes OpticsPairs object and calculates one-period returns of
-        securities.
+        Initializes OpticsPairs object. One-period returns of securities
+        are calculated when first needed.
 
         :param data: pd.DataFrame containing time series returns of various
             assets. Dimensions of dataframe should be TxN.
+        :param spread_dtype: Data type used to store normalized spreads.
+            np.float32 halves the memory of self.norm_spreads.
+            Default is np.float64.
+        :param spread_path: Optional path of a .npy file. If given,
+            normalized spreads are stored in a memory-mapped file on disk
+            instead of in memory.
+        :param block_size: An integer to denote the number of pairs whose
+            spreads are processed at once. Bounds temporary arrays in the
+            spread and statistics stages. Default is 256.
+        :param cache: Optional PairCache. Engle-Granger results and spread
+            statistics are looked up in the cache by pair, price window and
+            parameters, and only missing results are computed.
+        :param returns: Optional pd.DataFrame of one-period returns of data,
+            excluding the first period. If given, returns are not
+            recalculated from prices. Otherwise they are calculated on
+            first access of self.returns.
+        :param profile: A boolean to denote whether each pipeline stage
+            records wall time, CPU time and item counts in
+            self.profile_records. Default is False.
+        :param profile_memory: A boolean to denote whether profiled stages
+            also trace their peak memory with tracemalloc. Tracing slows
+            stages down, so time and memory are best measured in separate
+            runs. Default is False.
+        :param profile_callback: Optional function called with the record
+            of each profiled stage.
         """
 
+        self.profile = profile
+        self.profile_memory = profile_memory
+        self.profile_callback = profile_callback
+        self.profile_records = []  # Records of profiled stages
+
+        self.cache = cache
+        self.spread_dtype = spread_dtype
+        self.spread_path = spread_path
+        self.block_size = block_size
         self.prices = data
         self.securities = self.prices.columns
-        self.returns = self.prices.pct_change()[1:]
+        self._returns = returns  # Calculated from prices on first access
         self.returns_reduced = None  # Reduced transform of returns from PCA
         self.components_ = None  # Components generated from PCA
         self.n_components_ = None  # Number of components of PCA
         self.explained_variance_ratio_ = None  # Vairance explained by PCA
+        self.sweep_components_ = None  # Components of the PCA sweep
+        self.sweep_explained_variance_ratio_ = None  # Variance of the sweep
+        self._sweep_returns_reduced = None  # Reduced returns of the sweep
         self.pairs = None  # Potential pairs found from OPTICS clusters
         self.engle_granger_tests = None  # pvalue Engle-Granger cointegration
+        self.series_lags = None  # ADF lag order selected per security
         self.norm_spreads = None  # Z-score of spreads generated from pairs
+        self.hedge_ratios = None  # Legs, alpha and beta fitted per pair
         self.hurst_exponents = None  # Hurst exponent  from normalized spreads
         self.half_lives = None  # Half-life of normalized spreads
         self.avg_cross_count = None  # Ann average count of spread crosses mean
+        self.ou_params = None  # OU speed, mean, sigma of normalized spreads
+        self.rolling_zscores = None  # KxTxP rolling z-scores per lookback
+        self.zscore_windows = None  # Lookback of each pair and multiple
         self.pairs_df = None  # Dataframeof summary stats and potential pairs
         self.filtered_pairs = None  # Filtered pairs_df
         self.cluster_labels = None  # Array of cluster labels for securities
+        self.clustering = None  # Fitted clustering model from find_pairs
+        self.stage_counts = None  # Survivors per stage of staged filtering
+        self._pca_params = None  # Arguments of the last .reduce_PCA() call
+        self._scaler = None  # Fitted scaler from PCA pipeline
+        self._returns_moments = None  # Running sums of returns for update()
+        self._cluster_components = None  # Loadings used by last clustering
+        self._cluster_params = None  # Arguments of the last .find_pairs()
+        self._recluster_params = None  # Arguments of the last .recluster()
+        self._filter_params = None  # Arguments of the last .filter_pairs()
+        self._staged_params = None  # Arguments of the last staged filter
+        self._hurst_params = None  # Arguments of the last Hurst exponents
+        self._trading_year = 252.0  # Periods per year of the cross counts
+        self._ou_dt = 1.0  # Time step of the last OU fit
+        self._zscore_params = None  # Arguments of the last rolling z-scores
+        self._fingerprints = None  # Hash of each security's price window
+        self._spread_keys = None  # Cache key of each pair's spread
+
+    @property
+    def returns(self):
+        """
+        One-period returns of prices, excluding the first period. Returns
+        are calculated on first access, so loading a saved model does not
+        read every page of memory-mapped prices.
+        """
+
+        if self._returns is None and self.prices is not None:
+            self._returns = self.prices.pct_change()[1:]
 
+        return self._returns
+
+    @returns.setter
+    def returns(self, returns):
+        self._returns = returns
+
+    @_profiled(lambda op: len(op.securities))
     def reduce_PCA(self,
                    n_components_: int = 3,
                    Scaler=StandardScaler(),
-                   random_state: int = 42):
+                   random_state: int = 42,
+                   svd_solver: str = 'auto',
+                   dtype=None):
         """
         Reduces self.returns to dimensions equal to n_components_ through
         principal component analysis. Returns are first scaled via the Scaler
@@ -74,6 +273,12 @@ class OpticsPairs:
             recommended for principal component analysis.
         :param random_state: An integer to denote the seed for PCA() to insure
             reproducibility.
+        :param svd_solver: A string passed to PCA(). 'randomized' runs a
+            truncated randomized SVD, which is faster for wide universes.
+            Default value is 'auto'.
+        :param dtype: Optional data type returns are cast to before
+            fitting, e.g. np.float32 to halve memory. Default keeps the
+            dtype of self.returns.
         """
 
         if self.returns is None:
@@ -83,38 +288,290 @@ class OpticsPairs:
         if n_components_ > int(15):
             warnings.warn("Maximum n_components_ recommended is 15")
 
-        # PCA pipeline
-        pipe = Pipeline([
-            # Normalize raw data via user input scaler
-            ('scaler', Scaler),
-            # Perform PCA on scaled returns
-            ('pca', PCA(n_components=n_components_, random_state=random_state))
-        ])
+        pipe = OpticsPairs._pca_pipeline(n_components_, Scaler,
+                                         random_state, svd_solver)
+
+        returns = self.returns
+        if dtype is not None:
+            returns = returns.values.astype(dtype)
 
-        self.returns_reduced = pipe.fit_transform(self.returns)
+        self.returns_reduced = pipe.fit_transform(returns)
         self.components_ = pipe['pca'].components_
         self.n_components_ = pipe['pca'].n_components_
         self.explained_variance_ratio_ = pipe['pca'].explained_variance_ratio_
+        self._scaler = pipe['scaler']
+        self._pca_params = {'n_components_': n_components_,
+                            'Scaler': Scaler,
+                            'random_state': random_state,
+                            'svd_solver': svd_solver,
+                            'dtype': dtype}
+        self._returns_moments = None
+
+    @staticmethod
+    def _pca_pipeline(n_components_: int,
+                      Scaler,
+                      random_state: int,
+                      svd_solver: str = 'auto'):
+        """
+        Returns an unfitted pipeline of Scaler and PCA. Scaler is cloned so
+        the shared default instance is never fitted.
+        """
+
+        return Pipeline([
+            # Normalize raw data via user input scaler
+            ('scaler', clone(Scaler)),
+            # Perform PCA on scaled returns
+            ('pca', PCA(n_components=n_components_,
+                        random_state=random_state,
+                        svd_solver=svd_solver))
+        ])
+
+    def sweep_PCA(self,
+                  max_components: int = 15,
+                  Scaler=StandardScaler(),
+                  random_state: int = 42,
+                  svd_solver: str = 'auto',
+                  dtype=None):
+        """
+        Fits one decomposition with max_components components. The leading
+        k components of that fit are the k-component PCA, so loadings and
+        explained variance for every k up to max_components are available
+        without refitting. Use .select_n_components() to set the
+        components used by .find_pairs().
+
+        Returns a dataframe of explained and cumulative explained variance
+        ratio for every number of components.
+
+        See .reduce_PCA() for parameters.
+        """
+
+        self.reduce_PCA(max_components, Scaler, random_state, svd_solver,
+                        dtype)
+
+        self.sweep_components_ = self.components_
+        self.sweep_explained_variance_ratio_ = self.explained_variance_ratio_
+        self._sweep_returns_reduced = self.returns_reduced
 
-    def find_pairs(self):
+        return pd.DataFrame(
+            {'explained_variance_ratio': self.explained_variance_ratio_,
+             'cumulative_explained_variance':
+                np.cumsum(self.explained_variance_ratio_)},
+            index=pd.RangeIndex(1, self.n_components_ + 1,
+                                name='n_components'))
+
+    def select_n_components(self, n_components_: int):
+        """
+        Sets PCA results to the leading n_components_ components of the
+        fit from .sweep_PCA().
+
+        :param n_components_: An integer to denote number of dimensions.
+        """
+
+        if self.sweep_components_ is None:
+            raise ValueError("sweep_components_ not found: must run \
+                             .sweep_PCA() before this function")
+
+        if n_components_ > len(self.sweep_components_):
+            raise ValueError("n_components_ is larger than the sweep")
+
+        self.components_ = self.sweep_components_[:n_components_]
+        self.n_components_ = n_components_
+        self.explained_variance_ratio_ = \
+            self.sweep_explained_variance_ratio_[:n_components_]
+        self.returns_reduced = \
+            self._sweep_returns_reduced[:, :n_components_]
+        self._pca_params['n_components_'] = n_components_
+
+    @_profiled(lambda op: len(op.securities))
+    def reduce_PCA_incremental(self,
+                               returns=None,
+                               n_components_: int = 3,
+                               batch_size: int = 10000):
+        """
+        Reduces returns through principal component analysis while reading
+        them in row blocks, for return matrices that do not fit in memory.
+        Returns are scaled with StandardScaler.partial_fit() in a first
+        pass, decomposed with IncrementalPCA.partial_fit() in a second
+        pass and transformed in a third pass.
+
+        :param returns: A TxN array like object, or the path of a .npy file
+            which is memory-mapped, holding the same rows as self.returns.
+            Default is self.returns.
+        :param n_components_: An integer to denote number of dimensions.
+        :param batch_size: An integer to denote the number of rows read per
+            block. Must be at least n_components_.
+        """
+
+        if returns is None:
+            returns = self.returns.values
+        elif isinstance(returns, str):
+            returns = np.load(returns, mmap_mode='r')
+
+        if n_components_ > int(15):
+            warnings.warn("Maximum n_components_ recommended is 15")
+
+        n_obs = len(returns)
+        blocks = [(start, min(start + batch_size, n_obs))
+                  for start in range(0, n_obs, batch_size)]
+
+        scaler = StandardScaler()
+        for start, stop in blocks:
+            scaler.partial_fit(returns[start:stop])
+
+        pca = IncrementalPCA(n_components=n_components_)
+        for start, stop in blocks:
+            block = scaler.transform(returns[start:stop])
+            # Fold a short final block into the fit only if it is valid
+            if len(block) >= n_components_:
+                pca.partial_fit(block)
+
+        returns_reduced = np.empty((n_obs, n_components_))
+        for start, stop in blocks:
+            returns_reduced[start:stop] = pca.transform(
+                scaler.transform(returns[start:stop]))
+
+        self.returns_reduced = returns_reduced
+        self.components_ = pca.components_
+        self.n_components_ = pca.n_components_
+        self.explained_variance_ratio_ = pca.explained_variance_ratio_
+        self._scaler = scaler
+        self._pca_params = {'n_components_': n_components_,
+                            'Scaler': StandardScaler()}
+        self._returns_moments = None
+
+    @_profiled(_n_pairs)
+    def find_pairs(self,
+                   algorithm: str = 'auto',
+                   n_neighbors: int = None,
+                   n_jobs: int = None,
+                   clustering=None,
+                   **optics_kwargs):
         """
         Uses OPTICS algorithim to find clusters of similar securities within
         PCA component space. Once clusters labels are assigned, function
         generates series of tuples containing unique pairs of securities
         within the same cluster.
+
+        :param algorithm: A string to denote the neighbourhood search used
+            by OPTICS. 'auto', 'ball_tree', 'kd_tree' and 'brute' are
+            passed to OPTICS. 'knn_graph' precomputes a sparse graph of
+            each security's n_neighbors nearest neighbours with a tree
+            index. 'ann' builds the graph with approximate nearest
+            neighbour descent and requires pynndescent.
+            See OpticsPairs.cluster(). Default value is 'auto'.
+        :param n_neighbors: An integer to denote the number of neighbours
+            kept per security in a precomputed graph. Securities outside
+            each other's graph are treated as unreachable.
+        :param n_jobs: An integer to denote the number of parallel jobs
+            for the neighbour search.
+        :param clustering: An optional unfitted estimator with a fit()
+            method and labels_ attribute, used instead of OPTICS.
+        :param optics_kwargs: Keyword arguments passed to OPTICS, e.g.
+            min_samples or xi.
         """
 
         if self.returns_reduced is None:
             raise ValueError("returns_reduced not found: must run \
                              .reduce_PCA() before this function")
 
-        # Initialize and fit OPTICS cluster to PCA components
-        clustering = OPTICS()
-        clustering.fit(self.components_.T)
+        # Initialize and fit cluster to PCA components
+        fitted = OpticsPairs.cluster(self.components_.T,
+                                     algorithm=algorithm,
+                                     n_neighbors=n_neighbors,
+                                     n_jobs=n_jobs,
+                                     clustering=clustering,
+                                     **optics_kwargs)
+
+        self.clustering = fitted
+        self._set_pairs(fitted.labels_)
+        self._cluster_components = self.components_
+        self._cluster_params = {'algorithm': algorithm,
+                                'n_neighbors': n_neighbors,
+                                'n_jobs': n_jobs,
+                                'clustering': clustering,
+                                **optics_kwargs}
+        self._recluster_params = None
+
+    def recluster(self,
+                  cluster_method: str = 'xi',
+                  xi: float = 0.05,
+                  eps: float = None,
+                  min_samples=None,
+                  min_cluster_size=None,
+                  predecessor_correction: bool = True):
+        """
+        Re-extracts cluster labels from the reachability ordering of the
+        OPTICS model fitted by .find_pairs() and rebuilds self.pairs,
+        without recomputing core distances. A sweep over extraction
+        parameters therefore costs one OPTICS fit.
+
+        min_samples only changes how clusters are extracted. Core and
+        reachability distances keep the min_samples used in the fit.
+
+        :param cluster_method: A string to denote the extraction method,
+            'xi' or 'dbscan'. Default value is 'xi'.
+        :param xi: A floating number to denote the minimum steepness on
+            the reachability plot that bounds a cluster. Used by 'xi'.
+        :param eps: A floating number to denote the maximum reachability
+            distance within a cluster. Required by 'dbscan'.
+        :param min_samples: An integer, or fraction of securities, used by
+            'xi'. Default is the value used in the fit.
+        :param min_cluster_size: An integer, or fraction of securities, to
+            denote the minimum cluster size used by 'xi'. Default is
+            min_samples.
+        :param predecessor_correction: A boolean to denote whether 'xi'
+            corrects clusters using predecessors from the fit.
+        """
+
+        if not hasattr(self.clustering, 'reachability_'):
+            raise ValueError("OPTICS model not found: must run \
+                             .find_pairs() with an OPTICS backend before \
+                             this function")
+
+        optics = self.clustering
+
+        if cluster_method == 'xi':
+            labels, _ = cluster_optics_xi(
+                reachability=optics.reachability_,
+                predecessor=optics.predecessor_,
+                ordering=optics.ordering_,
+                min_samples=(optics.min_samples if min_samples is None
+                             else min_samples),
+                min_cluster_size=min_cluster_size,
+                xi=xi,
+                predecessor_correction=predecessor_correction)
+        elif cluster_method == 'dbscan':
+            if eps is None:
+                raise ValueError("eps is required for cluster_method \
+                                 'dbscan'")
+            labels = cluster_optics_dbscan(
+                reachability=optics.reachability_,
+                core_distances=optics.core_distances_,
+                ordering=optics.ordering_,
+                eps=eps)
+        else:
+            raise ValueError("cluster_method must be 'xi' or 'dbscan'")
+
+        self._set_pairs(labels)
+        self._recluster_params = {
+            'cluster_method': cluster_method,
+            'xi': xi,
+            'eps': eps,
+            'min_samples': min_samples,
+            'min_cluster_size': min_cluster_size,
+            'predecessor_correction': predecessor_correction}
+
+    def _set_pairs(self, labels: np.ndarray):
+        """
+        Sets cluster labels and generates the series of unique pairs of
+        securities within the same cluster.
+
+        :param labels: An integer array of cluster labels per security.
+        """
 
         # Create cluster data frame and identify trading pairs
         clusters = pd.DataFrame({'security': self.securities,
-                                 'cluster': clustering.labels_})
+                                 'cluster': labels})
         # Clusters with label == -1 are 'noise'
         # From OPTICS sk-learn documentation: Noisy samples and points
         # which are not included in a leaf cluster of cluster_hierarchy_
@@ -129,13 +586,271 @@ class OpticsPairs:
         print(f"Found {len(pairs)} potential pairs")
 
         self.pairs = pd.Series(pairs)
-        self.cluster_labels = clustering.labels_
+        self.cluster_labels = labels
 
-    def calc_eg_norm_spreads(self):
+    def update(self,
+               new_prices: pd.DataFrame,
+               window: int = None,
+               drift_threshold: float = 0.1,
+               **eg_kwargs):
+        """
+        Appends new bars to prices and refreshes the fitted stages without
+        rebuilding the object.
+
+        Returns are only calculated for the new bars. If .reduce_PCA() was
+        run with a StandardScaler, PCA is refreshed from running sums of
+        returns and their cross-products, so appending k bars costs
+        O(k*N^2) plus one NxN eigendecomposition instead of a refit on the
+        full history. Other scalers fall back to refitting .reduce_PCA().
+        Clusters are only refitted if the loadings moved more than
+        drift_threshold since the last .find_pairs(), and labels are then
+        re-extracted with the last .recluster() arguments. Spreads and
+        statistics that were already calculated are recalculated over the
+        updated window with their last arguments, and .filter_pairs() or
+        .filter_pairs_staged() is rerun with its last arguments.
+
+        :param new_prices: pd.DataFrame of new bars with the same columns
+            as prices. Bars at or before the last stored bar are ignored.
+        :param window: An optional integer to denote the number of most
+            recent bars kept in prices, for a rolling formation period.
+        :param drift_threshold: A floating number to denote the largest
+            absolute change in any PCA loading tolerated before clusters
+            are refitted. Default value is 0.1.
+        :param eg_kwargs: Keyword arguments passed to
+            .calc_eg_norm_spreads() or .filter_pairs_staged().
+        """
+
+        if not new_prices.columns.equals(self.securities):
+            raise ValueError("new_prices must have the same columns as \
+                             prices")
+
+        if self.components_ is not None and self._scaler is None:
+            raise ValueError("PCA arguments not found: models restored by \
+                             .load() with a custom Scaler must rerun \
+                             .reduce_PCA() before this function")
+
+        if self.cluster_labels is not None and (
+                self._cluster_params is None or
+                self._cluster_components is None):
+            raise ValueError("clustering arguments not found: models \
+                             restored by .load() with a custom clustering \
+                             must rerun .find_pairs() before this function")
+
+        new_prices = new_prices[new_prices.index > self.prices.index[-1]]
+        if len(new_prices) == 0:
+            warnings.warn("No new bars found in new_prices")
+            return
+
+        # Moments of the existing window, before anything is appended
+        if (self.components_ is not None and
+                self._returns_moments is None):
+            self._returns_moments = OpticsPairs._moments(self.returns.values)
+
+        # Calculate returns of new bars only
+        new_returns = pd.concat([self.prices.iloc[-1:], new_prices])
+        new_returns = new_returns.pct_change()[1:]
+
+        self.prices = pd.concat([self.prices, new_prices])
+        self.returns = pd.concat([self.returns, new_returns])
+
+        # Drop bars that fall out of the rolling window
+        dropped_returns = self.returns.iloc[:0]
+        if window is not None and len(self.prices) > window:
+            n_drop = len(self.prices) - window
+            dropped_returns = self.returns.iloc[:n_drop]
+            self.prices = self.prices.iloc[n_drop:]
+            self.returns = self.returns.iloc[n_drop:]
+
+        # Lag orders and fingerprints belong to the old window
+        self.series_lags = None
+        self._fingerprints = None
+
+        if self.components_ is None:
+            return
+
+        self._update_PCA(new_returns.values, dropped_returns.values)
+
+        refitted = False
+        if self.cluster_labels is not None:
+            drift = np.abs(self.components_ - self._cluster_components).max()
+            if drift > drift_threshold:
+                print(f"Loadings drifted by {drift:.3f}: refitting clusters")
+                recluster_params = self._recluster_params
+                self.find_pairs(**self._cluster_params)
+                refitted = True
+                if recluster_params is not None:
+                    self.recluster(**recluster_params)
+
+        if self.norm_spreads is None:
+            return
+
+        if self._staged_params is not None:
+            self.filter_pairs_staged(**{**self._staged_params, **eg_kwargs})
+        else:
+            self.calc_eg_norm_spreads(**eg_kwargs)
+
+            if self.hurst_exponents is not None:
+                self.calc_hurst_exponents(**(self._hurst_params or {}))
+
+            if (self.half_lives is not None or
+                    self.avg_cross_count is not None):
+                self.calc_spread_statistics(trading_year=self._trading_year)
+
+            if self._filter_params is not None:
+                self.filter_pairs(**self._filter_params)
+
+        if self.ou_params is not None:
+            self.calc_ou_params(dt=self._ou_dt)
+
+        if self.rolling_zscores is not None:
+            pairs = self._zscore_params['pairs']
+            if pairs is not None and (
+                    refitted or
+                    not pd.Index(pairs).isin(self.norm_spreads.columns).all()):
+                # Labels passed to .calc_rolling_zscores() no longer apply
+                warnings.warn("Pairs of rolling_zscores changed: reset to "
+                              "None, rerun .calc_rolling_zscores()")
+                self.rolling_zscores = None
+                self.zscore_windows = None
+                self._zscore_params = None
+            else:
+                self.calc_rolling_zscores(**self._zscore_params)
+
+    def _update_PCA(self,
+                    new_returns: np.ndarray,
+                    dropped_returns: np.ndarray):
+        """
+        Updates PCA results after returns were appended to, or dropped
+        from, self.returns. Falls back to .reduce_PCA() if the scaler is
+        not a StandardScaler.
+        """
+
+        if not isinstance(self._scaler, StandardScaler):
+            self.reduce_PCA(**self._pca_params)
+            return
+
+        n_obs, sums, cross = self._returns_moments
+        n_obs += len(new_returns) - len(dropped_returns)
+        sums = sums + new_returns.sum(axis=0) - dropped_returns.sum(axis=0)
+        cross = (cross + new_returns.T @ new_returns -
+                 dropped_returns.T @ dropped_returns)
+        self._returns_moments = (n_obs, sums, cross)
+
+        # Correlation matrix of returns equals covariance of scaled returns
+        mean = sums/n_obs
+        var = np.diag(cross)/n_obs - mean**2
+        scale = np.sqrt(var)
+        corr = (cross/n_obs - np.outer(mean, mean))/np.outer(scale, scale)
+
+        # Leading eigenvectors are the principal components
+        eigvals, eigvecs = np.linalg.eigh(corr)
+        order = np.argsort(eigvals)[::-1][:self.n_components_]
+        components = eigvecs[:, order].T
+
+        # Keep the sign of each component consistent with the last fit
+        signs = np.sign(np.sum(components*self.components_, axis=1))
+        signs[signs == 0] = 1.0
+        components *= signs[:, np.newaxis]
+
+        self.components_ = components
+        self.explained_variance_ratio_ = eigvals[order]/eigvals.sum()
+        self.returns_reduced = ((self.returns.values - mean)/scale @
+                                components.T)
+
+    @staticmethod
+    def _moments(returns: np.ndarray):
+        """
+        Returns the number of observations, column sums and cross-product
+        matrix of a TxN array of returns.
+        """
+
+        return len(returns), returns.sum(axis=0), returns.T @ returns
+
+    @staticmethod
+    def cluster(loadings: np.ndarray,
+                algorithm: str = 'auto',
+                n_neighbors: int = None,
+                n_jobs: int = None,
+                clustering=None,
+                **optics_kwargs):
+        """
+        Fits a clustering backend to security loadings and returns the
+        fitted estimator. See .find_pairs() for parameters.
+
+        :param loadings: An NxK array of security loadings.
+        """
+
+        if clustering is not None:
+            return clustering.fit(loadings)
+
+        if algorithm not in ['knn_graph', 'ann']:
+            clustering = OPTICS(algorithm=algorithm, n_jobs=n_jobs,
+                                **optics_kwargs)
+            return clustering.fit(loadings)
+
+        n_samples = len(loadings)
+        min_samples = optics_kwargs.get('min_samples', 5)
+        if n_neighbors is None:
+            n_neighbors = max(50, 4*min_samples)
+        n_neighbors = min(n_neighbors, n_samples - 1)
+
+        if algorithm == 'knn_graph':
+            neighbors = NearestNeighbors(n_neighbors=n_neighbors,
+                                         n_jobs=n_jobs)
+            graph = neighbors.fit(loadings).kneighbors_graph(
+                mode='distance')
+        else:
+            try:
+                from pynndescent import NNDescent
+            except ImportError:
+                raise ImportError("algorithm='ann' requires pynndescent: "
+                                  "pip install pynndescent")
+
+            # The nearest neighbour of each point is itself, drop it
+            index = NNDescent(loadings, n_neighbors=n_neighbors + 1,
+                              n_jobs=n_jobs if n_jobs else 1)
+            indices, distances = index.neighbor_graph
+            rows = np.repeat(np.arange(n_samples), n_neighbors)
+            graph = sparse.csr_matrix(
+                (distances[:, 1:].ravel(), (rows, indices[:, 1:].ravel())),
+                shape=(n_samples, n_samples))
+
+        clustering = OPTICS(metric='precomputed', n_jobs=n_jobs,
+                            **optics_kwargs)
+        return clustering.fit(graph)
+
+    @_profiled(_n_pairs)
+    def calc_eg_norm_spreads(self,
+                             n_jobs: int = 1,
+                             chunk_size: int = None,
+                             executor=None,
+                             eg_lag=None):
         """
         Calculates the p-value of the t-stat from the Engle-Granger
         cointegration test. Calculates normalized beta-adjusted spread
         series of potential pairs.
+
+        The Engle-Granger tests are run per pair. The hedge ratios and
+        spreads of all pairs are then fitted in one batch through
+        OpticsPairs.batch_ols_spreads.
+
+        Pairs are split into chunks which can be run across a process pool.
+        Results keep the order of self.pairs. If a chunk fails in a worker,
+        a warning is raised and its p-values are set to NaN.
+
+        :param n_jobs: An integer to denote the number of worker processes.
+            -1 uses all available cores. Default value is 1 (serial).
+        :param chunk_size: An integer to denote the number of pairs sent to a
+            worker per task. Default splits pairs into four chunks per worker.
+        :param executor: An optional concurrent.futures executor to submit
+            chunks to instead of creating a process pool. The executor is not
+            shut down by this function.
+        :param eg_lag: ADF lag order used by the Engle-Granger tests.
+            None runs ts.coint with an AIC lag search on every test.
+            An integer uses that fixed lag for every pair. 'series' picks
+            one AIC lag per security, caches it in self.series_lags and
+            uses the larger lag of the two legs in both test directions.
+            Default value is None.
         """
 
         if self.prices is None:
@@ -146,88 +861,571 @@ class OpticsPairs:
             raise ValueError("pairs not found: must run .find_pairs() \
                              before this function")
 
-        engle_granger_tests = []
-        norm_spreads = []
+        pair_idx = self._pair_positions()
 
-        # Test each pair for cointegration
-        for pair in self.pairs:
+        engle_granger_tests, flipped = self._eg_tests(
+            pair_idx, n_jobs, chunk_size, executor, eg_lag)
 
-            security_0 = self.prices[pair[0]]
-            security_1 = self.prices[pair[1]]
+        # Order each pair as (dependent, independent) from the test result
+        dependent = np.where(flipped, pair_idx[:, 1], pair_idx[:, 0])
+        independent = np.where(flipped, pair_idx[:, 0], pair_idx[:, 1])
 
-            # Get independent and dependent variables
-            # for OLS calculation and corresponding
-            # pvalue for Engle-Granger tests
-            pvalue, x, y = OpticsPairs.get_ols_variables(
-                security_0, security_1)
-            engle_granger_tests.append(pvalue)
+        self._fit_spreads(dependent, independent)
 
-            # Get parameters and calculate spread
-            model = sm.OLS(y, x)
-            result = model.fit()
-            alpha, beta = result.params[0], result.params[1]
+        if self.cache is not None:
+            # Spreads depend on the regression direction and storage dtype.
+            # Pairs without a test result have no key, so statistics of
+            # their fallback direction are never cached
+            keys = self._pair_cache_keys(
+                np.column_stack([dependent, independent]), 'spread',
+                np.dtype(self.spread_dtype).str)
+            self._spread_keys = pd.Series(
+                [None if np.isnan(pvalue) else key
+                 for key, pvalue in zip(keys, engle_granger_tests)],
+                dtype=object)
+        self.engle_granger_tests = pd.Series(engle_granger_tests)
 
-            spread = y - (alpha + beta*x.T[1])
-            norm_spread = OpticsPairs.calc_zscore(spread)
-            norm_spreads.append(norm_spread)
+    def _fit_spreads(self,
+                     dependent: np.ndarray,
+                     independent: np.ndarray,
+                     index=None):
+        """
+        Regresses each dependent security on its independent security one
+        block of pairs at a time, storing the normalized spreads in
+        self.norm_spreads and the fitted legs in self.hedge_ratios.
+
+        :param dependent: An integer array of dependent column positions.
+        :param independent: An integer array of independent column positions.
+        :param index: Optional pair labels. Default is a range index.
+        """
 
-        # Convert spreads from list to dataframe
-        norm_spreads = pd.DataFrame(np.transpose(norm_spreads),
-                                    index=self.prices.index)
+        prices = self.prices.values
 
-        self.norm_spreads = norm_spreads
-        self.engle_granger_tests = pd.Series(engle_granger_tests)
+        # Release any previous spreads before allocating new storage
+        self.norm_spreads = None
+        norm_spreads = self._allocate_spreads(len(prices), len(dependent))
+
+        alpha = np.empty(len(dependent))
+        beta = np.empty(len(dependent))
+
+        # Get parameters and calculate spreads for a block of pairs at once
+        for start in range(0, len(dependent), self.block_size):
+            stop = start + self.block_size
+            alpha[start:stop], beta[start:stop], spreads = \
+                OpticsPairs.batch_ols_spreads(prices,
+                                              dependent[start:stop],
+                                              independent[start:stop])
+            norm_spreads[:, start:stop] = OpticsPairs.calc_zscore(spreads)
+
+        self.hedge_ratios = self._hedge_ratio_frame(
+            dependent, independent, alpha, beta, index=index)
+
+        if isinstance(norm_spreads, np.memmap):
+            norm_spreads.flush()
+
+        # Wrap spread array in a dataframe without copying
+        self.norm_spreads = pd.DataFrame(norm_spreads,
+                                         index=self.prices.index,
+                                         columns=index,
+                                         copy=False)
+
+    def _pair_positions(self):
+        """
+        Returns a Px2 integer array of the column positions in self.prices
+        of both securities in each pair.
+        """
+
+        columns = {security: i for i, security in enumerate(self.securities)}
+        pair_idx = np.array([(columns[pair[0]], columns[pair[1]])
+                             for pair in self.pairs], dtype=int)
+
+        return pair_idx.reshape(-1, 2)
+
+    def _eg_tests(self,
+                  pair_idx: np.ndarray,
+                  n_jobs: int = 1,
+                  chunk_size: int = None,
+                  executor=None,
+                  eg_lag=None):
+        """
+        Runs the Engle-Granger tests of the given pairs in process or across
+        an executor. Returns p-values and whether the second security of
+        each pair is the dependent variable. Results found in self.cache
+        are not recomputed. See .calc_eg_norm_spreads() for parameters.
+        """
+
+        if self.cache is None:
+            return self._compute_eg_tests(pair_idx, n_jobs, chunk_size,
+                                          executor, eg_lag)
+
+        keys = self._pair_cache_keys(pair_idx, 'engle_granger', eg_lag)
+        found = self.cache.get_many(keys)
+
+        pvalues = np.empty(len(pair_idx))
+        flipped = np.empty(len(pair_idx), dtype=bool)
+        miss = np.array([key not in found for key in keys], dtype=bool)
+
+        for i in np.flatnonzero(~miss):
+            pvalues[i], flipped[i] = found[keys[i]]
+
+        if miss.any():
+            pvalues[miss], flipped[miss] = self._compute_eg_tests(
+                pair_idx[miss], n_jobs, chunk_size, executor, eg_lag)
+
+            # Failed chunks are NaN and should be retried on the next run
+            self.cache.put_many({
+                keys[i]: [pvalues[i], bool(flipped[i])]
+                for i in np.flatnonzero(miss) if not np.isnan(pvalues[i])})
+
+        return pvalues, flipped
+
+    def _compute_eg_tests(self,
+                          pair_idx: np.ndarray,
+                          n_jobs: int,
+                          chunk_size: int,
+                          executor,
+                          eg_lag):
+        """
+        Runs the Engle-Granger tests of the given pairs in process or across
+        an executor, without the cache.
+        """
+
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+
+        prices = self.prices.values
+
+        if eg_lag is None:
+            lags = None
+        elif eg_lag == 'series':
+            series_lags = self.calc_series_lags().values
+            lags = series_lags[pair_idx].max(axis=1)
+        else:
+            lags = np.full(len(pair_idx), int(eg_lag))
+
+        if executor is None and n_jobs == 1:
+            # Test each pair for cointegration in process
+            return _eg_test_chunk(prices, pair_idx, lags)
+
+        return self._run_eg_chunks(prices, pair_idx, lags, n_jobs,
+                                   chunk_size, executor)
+
+    def _pair_cache_keys(self, pair_idx: np.ndarray, *params):
+        """
+        Returns a cache key per pair from the fingerprints of both
+        securities' price windows and the given parameters.
+        """
+
+        if self._fingerprints is None:
+            index = PairCache.fingerprint(np.asarray(self.prices.index))
+            self._fingerprints = [
+                PairCache.make_key(index, PairCache.fingerprint(
+                    self.prices[security].values))
+                for security in self.securities]
+
+        return [PairCache.make_key(self._fingerprints[idx_0],
+                                   self._fingerprints[idx_1],
+                                   *params)
+                for idx_0, idx_1 in pair_idx]
+
+    def _cached_statistics(self, name: str, params, compute):
+        """
+        Returns a PxK array of per-pair statistics of self.norm_spreads.
+        Statistics found in self.cache are reused and compute is only
+        called with the column positions of missing pairs.
+
+        :param name: A string to identify the statistic in cache keys.
+        :param params: JSON serializable parameters of the statistic.
+        :param compute: A function of an integer array of column positions
+            returning a len(positions)xK array.
+        """
+
+        n_pairs = self.norm_spreads.shape[1]
+
+        if self.cache is None or self._spread_keys is None:
+            return compute(np.arange(n_pairs))
+
+        spread_keys = self._spread_keys[self.norm_spreads.columns]
+        keys = [None if key is None else PairCache.make_key(key, name, params)
+                for key in spread_keys]
+        found = self.cache.get_many([key for key in keys if key is not None])
+        miss = np.array([key not in found for key in keys], dtype=bool)
+
+        values = None
+        if (~miss).any():
+            values = np.array([found[key] for key in keys if key in found])
+            values = values.reshape(-1, values.size//(~miss).sum())
+
+        if miss.any():
+            computed = compute(np.flatnonzero(miss))
+            self.cache.put_many({
+                keys[i]: row.tolist()
+                for i, row in zip(np.flatnonzero(miss), computed)
+                if keys[i] is not None})
+            merged = np.empty((n_pairs, computed.shape[1]))
+            merged[miss] = computed
+            if values is not None:
+                merged[~miss] = values
+            values = merged
+
+        return values
+
+    def _pair_statistics(self,
+                         dependent: np.ndarray,
+                         independent: np.ndarray,
+                         hurst: bool = False,
+                         lags=None):
+        """
+        Calculates half-lives, cross counts and optionally Hurst exponents
+        of the normalized spreads of the given pairs, one block of pairs at
+        a time, without storing the spreads.
+
+        :param dependent: An integer array of dependent column positions.
+        :param independent: An integer array of independent column positions.
+        :param hurst: A boolean to denote whether Hurst exponents are
+            calculated. If False, NaN is returned in their place.
+        :param lags: An iterable of integer lags for the Hurst exponent.
+        """
+
+        prices = self.prices.values
+        n_pairs = len(dependent)
+        half_lives = np.empty(n_pairs)
+        cross_count = np.empty(n_pairs)
+        hurst_exponents = np.full(n_pairs, np.nan)
+
+        for start in range(0, n_pairs, self.block_size):
+            stop = start + self.block_size
+            _, _, spreads = OpticsPairs.batch_ols_spreads(
+                prices, dependent[start:stop], independent[start:stop])
+            spreads, half_lives[start:stop], cross_count[start:stop] = \
+                OpticsPairs.spread_statistics(spreads)
+            if hurst:
+                hurst_exponents[start:stop] = OpticsPairs.hurst_matrix(
+                    spreads, lags=lags, block_size=self.block_size)
+
+        return half_lives, cross_count, hurst_exponents
+
+    def _hedge_ratio_frame(self,
+                           dependent: np.ndarray,
+                           independent: np.ndarray,
+                           alpha: np.ndarray,
+                           beta: np.ndarray,
+                           index=None):
+        """
+        Returns a dataframe of each pair's dependent and independent
+        security, alpha and beta. The spread of a pair is
+        dependent - (alpha + beta*independent).
+        """
+
+        return pd.DataFrame({'dependent': self.securities[dependent],
+                             'independent': self.securities[independent],
+                             'alpha': alpha,
+                             'beta': beta},
+                            index=index)
+
+    def _allocate_spreads(self, n_obs: int, n_pairs: int):
+        """
+        Allocates a column-major TxP array for normalized spreads, either
+        in memory or as a memory-mapped .npy file at self.spread_path.
+        Column-major order keeps each pair's spread contiguous so
+        statistics can read it in column blocks.
+        """
+
+        if self.spread_path is None:
+            return np.empty((n_obs, n_pairs), dtype=self.spread_dtype,
+                            order='F')
+
+        return np.lib.format.open_memmap(self.spread_path,
+                                         mode='w+',
+                                         dtype=self.spread_dtype,
+                                         shape=(n_obs, n_pairs),
+                                         fortran_order=True)
+
+    def _spread_blocks(self, positions: np.ndarray = None):
+        """
+        Yields the offset of the first column and a TxB array for each
+        block of self.block_size normalized spreads.
+
+        :param positions: An optional integer array of column positions to
+            read. Default reads every column.
+        """
+
+        values = self.norm_spreads.values
+
+        if positions is None:
+            for start in range(0, values.shape[1], self.block_size):
+                yield start, values[:, start:start + self.block_size]
+            return
+
+        for start in range(0, len(positions), self.block_size):
+            yield start, values[:, positions[start:start + self.block_size]]
+
+    def drop_spreads(self, keep):
+        """
+        Keeps only the normalized spreads of the given pairs so memory
+        of rejected pairs can be released. Surviving spreads are copied
+        into memory.
+
+        :param keep: An index of pair labels whose spreads are kept.
+        """
+
+        if self.norm_spreads is None:
+            raise ValueError("norm_spreads not found: must run \
+                            .calc_eg_norm_spreads() before this function")
+
+        self.norm_spreads = self.norm_spreads.loc[:, keep]
+
+    def calc_series_lags(self):
+        """
+        Selects an ADF lag order for each security by AIC. Lags are cached
+        in self.series_lags and reused by later Engle-Granger runs.
+        """
+
+        if self.series_lags is None:
+            lags = [ts.adfuller(self.prices[security].values,
+                                autolag='AIC')[2]
+                    for security in self.securities]
+            self.series_lags = pd.Series(lags, index=self.securities)
+
+        return self.series_lags
 
     @staticmethod
-    def get_ols_variables(security_0: str,
-                          security_1: str):
+    def _run_eg_chunks(prices: np.ndarray,
+                       pair_idx: np.ndarray,
+                       lags: np.ndarray,
+                       n_jobs: int,
+                       chunk_size: int,
+                       executor):
+        """
+        Submits chunks of pairs to an executor and reassembles the results
+        in the original pair order.
+        """
+
+        n_pairs = len(pair_idx)
+        if chunk_size is None:
+            chunk_size = max(1, int(np.ceil(n_pairs/(4*max(n_jobs, 1)))))
+        bounds = [(start, min(start + chunk_size, n_pairs))
+                  for start in range(0, n_pairs, chunk_size)]
+
+        pool = executor
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=n_jobs)
+
+        try:
+            futures = []
+            for start, stop in bounds:
+                # Only send the price columns the chunk needs
+                chunk = pair_idx[start:stop]
+                cols, local_idx = np.unique(chunk, return_inverse=True)
+                futures.append(pool.submit(
+                    _eg_test_chunk,
+                    prices[:, cols],
+                    local_idx.reshape(-1, 2),
+                    None if lags is None else lags[start:stop]))
+
+            pvalues = np.full(n_pairs, np.nan)
+            flipped = np.zeros(n_pairs, dtype=bool)
+
+            for (start, stop), future in zip(bounds, futures):
+                try:
+                    chunk_pvalues, chunk_flipped = future.result()
+                except Exception as e:
+                    warnings.warn(f"Engle-Granger chunk of pairs "
+                                  f"{start}-{stop - 1} failed: {e!r}")
+                    continue
+                pvalues[start:stop] = chunk_pvalues
+                flipped[start:stop] = chunk_flipped
+        finally:
+            if executor is None:
+                pool.shutdown()
+
+        return pvalues, flipped
+
+    @staticmethod
+    def eg_test(security_0, security_1, lag: int = None):
         """
         Compares t-stats of two Engle-Granger cointegration tests.
-        Returns independent and dependent variables for OLS.
+        Returns the p-value of the chosen test and whether security_1
+        is the dependent variable.
 
-        :params security_0: String identifier of first security.
-        :params security_1: String identifier of second security.
+        :params security_0: An array like object of first security prices.
+        :params security_1: An array like object of second security prices.
+        :param lag: An optional integer ADF lag order used in both test
+            directions. If None, ts.coint selects the lag by AIC.
         """
 
-        test_0 = ts.coint(security_0, security_1)
-        test_1 = ts.coint(security_1, security_0)
+        if lag is None:
+            test_0 = ts.coint(security_0, security_1)
+            test_1 = ts.coint(security_1, security_0)
+        else:
+            test_0 = OpticsPairs.coint_fixed_lag(security_0, security_1, lag)
+            test_1 = OpticsPairs.coint_fixed_lag(security_1, security_0, lag)
 
         t_stat_0, pvalue_0 = test_0[0], test_0[1]
         t_stat_1, pvalue_1 = test_1[0], test_1[1]
 
         # Avoid reliance on dependent variable and choose smallest t-stat
         # for Engle-Granger Test
+        if abs(t_stat_0) < abs(t_stat_1):
+            return pvalue_0, False
+        else:
+            return pvalue_1, True
+
+    @staticmethod
+    def coint_fixed_lag(security_0, security_1, lag: int):
+        """
+        Engle-Granger cointegration test with a fixed ADF lag order.
+        Returns the t-stat and MacKinnon p-value, matching
+        ts.coint(security_0, security_1, maxlag=lag, autolag=None) without
+        building statsmodels models.
+
+        :params security_0: An array like object of first security prices.
+        :params security_1: An array like object of second security prices.
+        :param lag: An integer to denote the ADF lag order.
+        """
+
+        y = np.asarray(security_0, dtype=float)
+        x = np.asarray(security_1, dtype=float)
+
+        # Residuals of the cointegrating regression y = alpha + beta*x
+        x_dev = x - x.mean()
+        beta = (x_dev*(y - y.mean())).sum()/(x_dev**2).sum()
+        resid = (y - y.mean()) - beta*x_dev
+
+        t_stat = OpticsPairs.adf_tstat(resid, lag)
+        pvalue = mackinnonp(t_stat, regression='c', N=2)
+
+        return t_stat, pvalue
+
+    @staticmethod
+    def adf_tstat(series, lag: int):
+        """
+        Calculates the augmented Dickey-Fuller t-stat of a series with a
+        fixed lag order and no deterministic terms.
+
+        :param series: An array like object to test for a unit root.
+        :param lag: An integer to denote the number of lagged differences.
+        """
+
+        series = np.asarray(series, dtype=float)
+        diff = np.diff(series)
+        nobs = len(diff) - lag
+
+        # Regress differences on lagged level and lagged differences
+        exog = np.empty((nobs, lag + 1))
+        exog[:, 0] = series[lag:-1]
+        for i in range(1, lag + 1):
+            exog[:, i] = diff[lag - i:len(diff) - i]
+        endog = diff[lag:]
+
+        params, _, rank, _ = np.linalg.lstsq(exog, endog, rcond=None)
+        resid = endog - exog @ params
+        sigma2 = resid @ resid/(nobs - rank)
+        cov = sigma2*np.linalg.pinv(exog.T @ exog)
+
+        return params[0]/np.sqrt(cov[0, 0])
+
+    @staticmethod
+    def get_ols_variables(security_0: str,
+                          security_1: str):
+        """
+        Compares t-stats of two Engle-Granger cointegration tests.
+        Returns independent and dependent variables for OLS.
+
+        :params security_0: String identifier of first security.
+        :params security_1: String identifier of second security.
+        """
+
+        pvalue, flipped = OpticsPairs.eg_test(security_0, security_1)
+
         # Use corresponding independent and dependent variables to
         # calculate spread
-        if abs(t_stat_0) < abs(t_stat_1):
-            pvalue = pvalue_0
+        if not flipped:
             x = sm.add_constant(np.asarray(security_1))
             y = np.asarray(security_0)
         else:
-            pvalue = pvalue_1
             x = sm.add_constant(np.asarray(security_0))
             y = np.asarray(security_1)
 
         return pvalue, x, y
 
-    def calc_hurst_exponents(self):
+    @staticmethod
+    def batch_ols_spreads(prices: np.ndarray,
+                          dependent: np.ndarray,
+                          independent: np.ndarray):
+        """
+        Fits y = alpha + beta*x by least squares for many pairs at once and
+        returns alpha, beta and the residual spreads. Uses the closed-form
+        solution, so no statsmodels model is built per pair.
+
+        :param prices: A TxN array of security prices.
+        :param dependent: An integer array of length P with the column
+            position of each pair's dependent variable.
+        :param independent: An integer array of length P with the column
+            position of each pair's independent variable.
+        """
+
+        y = prices[:, dependent]
+        x = prices[:, independent]
+
+        x_mean = x.mean(axis=0)
+        y_mean = y.mean(axis=0)
+        x_dev = x - x_mean
+
+        beta = (x_dev*(y - y_mean)).sum(axis=0)/(x_dev**2).sum(axis=0)
+        alpha = y_mean - beta*x_mean
+
+        spreads = y - (alpha + beta*x)
+
+        return alpha, beta, spreads
+
+    @_profiled(_n_spreads)
+    def calc_hurst_exponents(self,
+                             lags=None,
+                             dtype=np.float64,
+                             block_size: int = None):
         """
         Calculates Hurst exponent of each potential pair's normalized spread.
+        All spreads are processed together by OpticsPairs.hurst_matrix.
+
+        :param lags: An iterable of integer lags used to estimate the
+            exponent, e.g. OpticsPairs.log_lags(). Default is range(2, 100).
+        :param dtype: Data type of the working buffer. np.float32 halves
+            the memory used for lagged differences. Default is np.float64.
+        :param block_size: An integer to denote the number of spreads
+            processed at once. Bounds the size of the working buffer.
+            Default is self.block_size.
         """
 
         if self.norm_spreads is None:
             raise ValueError("norm_spreads not found: must run \
                             .calc_eg_norm_spreads before this function")
 
-        hurst_exponents = []
+        if block_size is None:
+            block_size = self.block_size
 
-        # Calculate Hurst exponents and generate series
-        for col in self.norm_spreads.columns:
-            hurst_exp = OpticsPairs.hurst(self.norm_spreads[col].values)
-            hurst_exponents.append(hurst_exp)
+        lags = None if lags is None else [int(lag) for lag in lags]
 
-        self.hurst_exponents = pd.Series(hurst_exponents)
+        def compute(positions):
+            hurst_exponents = np.empty((len(positions), 1))
+            for start, block in self._spread_blocks(positions):
+                hurst_exponents[start:start + block.shape[1], 0] = \
+                    OpticsPairs.hurst_matrix(block,
+                                             lags=lags,
+                                             dtype=dtype,
+                                             block_size=block_size)
+            return hurst_exponents
 
+        hurst_exponents = self._cached_statistics(
+            'hurst', [lags, np.dtype(dtype).str], compute)
+        self._hurst_params = {'lags': lags,
+                              'dtype': dtype,
+                              'block_size': block_size}
+
+        self.hurst_exponents = pd.Series(hurst_exponents[:, 0],
+                                         index=self.norm_spreads.columns)
+
+    @_profiled(_n_spreads)
     def calc_half_lives(self):
         """
         Calculates half-life of each potential pair's normalized spread.
@@ -236,8 +1434,13 @@ class OpticsPairs:
             raise ValueError("norm_spreads not found: must run \
                             .calc_eg_norm_spreads before this function")
 
-        self.half_lives = self.norm_spreads.apply(OpticsPairs.half_life)
+        half_lives = self._spread_kernel_values(
+            'half_life', OpticsPairs.half_life_matrix)
 
+        self.half_lives = pd.Series(half_lives,
+                                    index=self.norm_spreads.columns)
+
+    @_profiled(_n_spreads)
     def calc_avg_cross_count(self, trading_year: float = 252.0):
         """
         Calculates the average number of instances per year the
@@ -259,15 +1462,182 @@ class OpticsPairs:
         n_years = n_days/trading_year
 
         # Find annual average cross count
-        cross_count = self.norm_spreads.apply(OpticsPairs.count_crosses)
-        self.avg_cross_count = cross_count/n_years
+        cross_count = self._spread_kernel_values(
+            'cross_count', OpticsPairs.count_crosses_matrix)
+
+        self.avg_cross_count = pd.Series(cross_count/n_years,
+                                         index=self.norm_spreads.columns)
+        self._trading_year = trading_year
+
+    @_profiled(_n_spreads)
+    def calc_spread_statistics(self, trading_year: float = 252.0):
+        """
+        Calculates half-lives and average cross counts of every potential
+        pair's normalized spread in one call to
+        OpticsPairs.spread_statistics. Equivalent to running
+        .calc_half_lives() and .calc_avg_cross_count().
+        """
+
+        if self.norm_spreads is None:
+            raise ValueError("norm_spreads not found: must run \
+                            .calc_eg_norm_spreads() before this function")
+
+        values = self._spread_statistic_values()
+
+        n_years = len(self.prices)/trading_year
+
+        self.half_lives = pd.Series(values[:, 0],
+                                    index=self.norm_spreads.columns)
+        self.avg_cross_count = pd.Series(values[:, 1]/n_years,
+                                         index=self.norm_spreads.columns)
+        self._trading_year = trading_year
+
+    @_profiled(_n_spreads)
+    def calc_ou_params(self, dt: float = 1.0):
+        """
+        Fits an Ornstein-Uhlenbeck process to each potential pair's
+        normalized spread with OpticsPairs.ou_fit_matrix. Mean and sigma
+        are in units of the normalized spread; the speed of mean reversion
+        theta does not depend on the scale and can rank pairs directly.
+
+        :param dt: A float to denote the time step between observations,
+            e.g. 1/252 for annualized parameters from daily bars.
+            Default value is 1.0 (per bar).
+        """
+
+        if self.norm_spreads is None:
+            raise ValueError("norm_spreads not found: must run \
+                            .calc_eg_norm_spreads() before this function")
+
+        def compute(positions):
+            values = np.empty((len(positions), 3))
+            for start, block in self._spread_blocks(positions):
+                stop = start + block.shape[1]
+                values[start:stop] = np.column_stack(
+                    OpticsPairs.ou_fit_matrix(block, dt=dt))
+            return values
+
+        values = self._cached_statistics('ou', [dt], compute)
+
+        self.ou_params = pd.DataFrame(values,
+                                      index=self.norm_spreads.columns,
+                                      columns=['theta', 'mu', 'sigma'])
+        self.ou_params['half_life'] = np.log(2)/self.ou_params['theta']
+        self._ou_dt = dt
+
+    @_profiled(_n_spreads)
+    def calc_rolling_zscores(self,
+                             multiples=(1.0, 2.0, 4.0),
+                             pairs=None,
+                             min_window: int = 2,
+                             dtype=np.float32):
+        """
+        Calculates rolling z-scores of spreads over several lookbacks at
+        once, each a multiple of the pair's half-life. Unlike
+        OpticsPairs.calc_zscore, every value only uses spreads up to its
+        own bar. Rolling z-scores do not change under scaling of a spread,
+        so they are calculated from the normalized spreads.
+
+        Sets self.rolling_zscores to a KxTxP array for K multiples, T bars
+        and P pairs, and self.zscore_windows to the lookback of each pair
+        and multiple. Values before a full lookback, and pairs without a
+        positive half-life, are NaN.
+
+        :param multiples: An iterable of floats to multiply half-lives by.
+            Default value is (1.0, 2.0, 4.0).
+        :param pairs: Optional index of pair labels. Default is
+            self.filtered_pairs.index, or every pair if pairs are not
+            filtered yet.
+        :param min_window: An integer to denote the shortest lookback.
+            Default value is 2.
+        :param dtype: Data type of the output. Default is np.float32.
+        """
+
+        if self.norm_spreads is None:
+            raise ValueError("norm_spreads not found: must run \
+                            .calc_eg_norm_spreads() before this function")
+
+        if self.half_lives is None:
+            raise ValueError("half_lives not found: must run \
+                            .calc_half_lives() before this function")
+
+        pairs_arg = pairs
+        if pairs is None:
+            pairs = (self.norm_spreads.columns if self.filtered_pairs is None
+                     else self.filtered_pairs.index)
+        pairs = pd.Index(pairs)
+
+        positions = self.norm_spreads.columns.get_indexer(pairs)
+        if (positions == -1).any():
+            raise ValueError(f"Pairs {list(pairs[positions == -1])} not found "
+                             f"in norm_spreads")
+        n_obs = len(self.norm_spreads)
+
+        # Lookback of each multiple and pair, NaN without a half-life
+        half_lives = self.half_lives.loc[pairs].values
+        windows = np.round(np.outer(multiples, half_lives))
+        windows[~(half_lives > 0)[np.newaxis, :].repeat(len(multiples), 0)] \
+            = np.nan
+        windows = np.clip(windows, min_window, n_obs)
+
+        zscores = np.empty((len(multiples), n_obs, len(pairs)), dtype=dtype)
+        for start, block in self._spread_blocks(positions):
+            stop = start + block.shape[1]
+            zscores[:, :, start:stop] = OpticsPairs.rolling_zscore_matrix(
+                block, windows[:, start:stop])
+
+        self.rolling_zscores = zscores
+        self.zscore_windows = pd.DataFrame(windows.T, index=pairs,
+                                           columns=list(multiples))
+        self._zscore_params = {'multiples': multiples,
+                               'pairs': pairs_arg,
+                               'min_window': min_window,
+                               'dtype': dtype}
+
+    def _spread_statistic_values(self):
+        """
+        Returns a Px2 array of half-lives and cross counts of
+        self.norm_spreads, computed block by block through
+        OpticsPairs.spread_statistics or read from self.cache.
+        """
+
+        def compute(positions):
+            values = np.empty((len(positions), 2))
+            for start, block in self._spread_blocks(positions):
+                stop = start + block.shape[1]
+                _, values[start:stop, 0], values[start:stop, 1] = \
+                    OpticsPairs.spread_statistics(block, normalize=False)
+            return values
+
+        return self._cached_statistics('spread_statistics', [], compute)
+
+    def _spread_kernel_values(self, name: str, kernel):
+        """
+        Returns an array of one statistic of self.norm_spreads, computed
+        block by block with a single columnar kernel or read from
+        self.cache.
+
+        :param name: A string to identify the statistic in cache keys.
+        :param kernel: A function of a TxB array returning B values, e.g.
+            OpticsPairs.half_life_matrix.
+        """
+
+        def compute(positions):
+            values = np.empty((len(positions), 1))
+            for start, block in self._spread_blocks(positions):
+                values[start:start + block.shape[1], 0] = kernel(block)
+            return values
 
+        return self._cached_statistics(name, [], compute)[:, 0]
+
+    @_profiled(_n_filtered)
     def filter_pairs(self,
                      max_pvalue: float = 0.05,
                      max_hurst_exp: float = 0.5,
                      max_half_life: float = 252.0,
                      min_half_life: float = 1.0,
-                     min_avg_cross: float = 12.0):
+                     min_avg_cross: float = 12.0,
+                     drop_rejected: bool = False):
         """
         Generates a summary dataframe of potential pairs containing:
             1. Engle-Granger p-value
@@ -292,6 +1662,9 @@ class OpticsPairs:
         :min_avg_cross: A floating number to eliminate potential pairs with
             average cross count less than user defined value.
             Default value set to 12.0
+        :param drop_rejected: A boolean to denote whether normalized spreads
+            of pairs that fail the criteria are dropped from
+            self.norm_spreads. Default value set to False.
         """
 
         required = [self.prices,
@@ -307,6 +1680,196 @@ class OpticsPairs:
                                 \n 4. half_lives \n 5. avg_cross_count")
 
         # Generate summary dataframe of potential trading pairs
+        pairs_df = self._summarize_pairs()
+
+        # Find pairs that meet user defined criteria
+        filtered_pairs = pairs_df.loc[OpticsPairs._meets_criteria(
+            pairs_df, max_pvalue, max_hurst_exp, max_half_life,
+            min_half_life, min_avg_cross)]
+
+        self.pairs_df = pairs_df
+        self.filtered_pairs = filtered_pairs
+        self._filter_params = {'max_pvalue': max_pvalue,
+                               'max_hurst_exp': max_hurst_exp,
+                               'max_half_life': max_half_life,
+                               'min_half_life': min_half_life,
+                               'min_avg_cross': min_avg_cross,
+                               'drop_rejected': drop_rejected}
+        self._staged_params = None
+
+        if drop_rejected:
+            self.drop_spreads(filtered_pairs.index)
+
+        if len(self.filtered_pairs) == 0:
+            print("No tradable pairs found. Try relaxing criteria.")
+        else:
+            n_pairs = len(self.filtered_pairs)
+            print(f"Found {n_pairs} tradable pairs!")
+
+    @_profiled(_n_filtered)
+    def filter_pairs_staged(self,
+                            max_pvalue: float = 0.05,
+                            max_hurst_exp: float = 0.5,
+                            max_half_life: float = 252.0,
+                            min_half_life: float = 1.0,
+                            min_avg_cross: float = 12.0,
+                            min_correlation: float = None,
+                            trading_year: float = 252.0,
+                            lags=None,
+                            **eg_kwargs):
+        """
+        Filters potential pairs through a cascade of criteria ordered by
+        cost. Each stage only evaluates pairs that passed every earlier
+        stage, so expensive statistics are skipped for pairs a cheap check
+        already rejected. Stages are:
+            1. Correlation of returns (only if min_correlation is set)
+            2. Average cross count
+            3. Half-life
+            4. Hurst exponent
+            5. Engle-Granger test
+            6. All criteria on the final spreads
+        Stages 2-4 compute provisional spreads in both regression
+        directions and only reject a pair once neither direction passes,
+        since the Engle-Granger test picks the direction later. Pairs are
+        then checked against all criteria in the direction chosen by the
+        test, as in .filter_pairs().
+
+        Sets the same attributes as running .calc_eg_norm_spreads(),
+        the statistics and .filter_pairs(). Statistics are those of the
+        direction chosen by the test, so pairs rejected before the
+        Engle-Granger stage have NaN statistics. Only spreads and hedge
+        ratios of the final pairs are kept, computed block by block into
+        self.spread_path if set. Survivor counts per stage are stored in
+        self.stage_counts.
+
+        :param min_correlation: A floating number to eliminate potential
+            pairs whose returns correlation is below min_correlation.
+            Default value set to None (stage skipped).
+        :param trading_year: A floating number of periods per year used for
+            the average cross count. Default value set to 252.0.
+        :param lags: An iterable of integer lags for the Hurst exponent.
+        :param eg_kwargs: Keyword arguments passed to the Engle-Granger
+            stage: n_jobs, chunk_size, executor and eg_lag. See
+            .calc_eg_norm_spreads().
+
+        See .filter_pairs() for the remaining parameters.
+        """
+
+        if self.prices is None:
+            raise ValueError("prices not found: must initialize with \
+                             price dataframe before this function")
+
+        if self.pairs is None:
+            raise ValueError("pairs not found: must run .find_pairs() \
+                             before this function")
+
+        pair_idx = self._pair_positions()
+        n_pairs = len(pair_idx)
+        n_years = len(self.prices)/trading_year
+
+        # Provisional statistics in both directions: row 0 regresses the
+        # first security on the second, row 1 the second on the first
+        directions = [pair_idx, pair_idx[:, ::-1]]
+        hurst_exponents = np.full((2, n_pairs), np.nan)
+        half_lives = np.full((2, n_pairs), np.nan)
+        cross_count = np.full((2, n_pairs), np.nan)
+        passed = np.ones((2, n_pairs), dtype=bool)
+
+        alive = np.arange(n_pairs)  # Positions of surviving pairs
+        stage_counts = {'candidates': n_pairs}
+
+        # Stage 1: correlation of returns
+        if min_correlation is not None:
+            corr = np.corrcoef(self.returns.values, rowvar=False)
+            corr = corr[pair_idx[:, 0], pair_idx[:, 1]]
+            alive = alive[corr[alive] >= min_correlation]
+            stage_counts['correlation'] = len(alive)
+
+        # Stages 2-3: cross count and half-life of provisional spreads. A
+        # pair survives while either direction passes every stage so far
+        for d, idx in enumerate(directions):
+            half_lives[d, alive], cross_count[d, alive], _ = \
+                self._pair_statistics(idx[alive, 0], idx[alive, 1])
+        cross_count /= n_years
+
+        passed &= cross_count >= min_avg_cross
+        alive = alive[passed[:, alive].any(axis=0)]
+        stage_counts['avg_cross_count'] = len(alive)
+
+        passed &= (half_lives >= min_half_life) & (half_lives <= max_half_life)
+        alive = alive[passed[:, alive].any(axis=0)]
+        stage_counts['half_life'] = len(alive)
+
+        # Stage 4: Hurst exponent of provisional spreads
+        for d, idx in enumerate(directions):
+            tested = alive[passed[d, alive]]
+            _, _, hurst_exponents[d, tested] = self._pair_statistics(
+                idx[tested, 0], idx[tested, 1], hurst=True, lags=lags)
+
+        passed &= hurst_exponents < max_hurst_exp
+        alive = alive[passed[:, alive].any(axis=0)]
+        stage_counts['hurst_exp'] = len(alive)
+
+        # Stage 5: Engle-Granger test
+        pvalues = np.full(n_pairs, np.nan)
+        flipped = np.zeros(n_pairs, dtype=bool)
+        pvalues[alive], flipped[alive] = self._eg_tests(pair_idx[alive],
+                                                        **eg_kwargs)
+        stage_counts['pvalue'] = int((pvalues[alive] <= max_pvalue).sum())
+
+        # Stage 6: keep the statistics of the direction chosen by the test.
+        # Provisional spreads in that direction are the final spreads, so
+        # pairs rejected before the test are left with NaN statistics
+        chosen = flipped.astype(int)
+        tested = np.zeros(n_pairs, dtype=bool)
+        tested[alive] = True
+        positions = np.arange(n_pairs)
+
+        self.engle_granger_tests = pd.Series(pvalues)
+        self.hurst_exponents = pd.Series(np.where(
+            tested, hurst_exponents[chosen, positions], np.nan))
+        self.half_lives = pd.Series(np.where(
+            tested, half_lives[chosen, positions], np.nan))
+        self.avg_cross_count = pd.Series(np.where(
+            tested, cross_count[chosen, positions], np.nan))
+
+        pairs_df = self._summarize_pairs()
+        filtered_pairs = pairs_df.loc[OpticsPairs._meets_criteria(
+            pairs_df, max_pvalue, max_hurst_exp, max_half_life,
+            min_half_life, min_avg_cross)]
+        stage_counts['final'] = len(filtered_pairs)
+
+        # Fit spreads and hedge ratios of the final pairs only
+        survivors = filtered_pairs.index.values
+        dependent = np.where(flipped, pair_idx[:, 1], pair_idx[:, 0])
+        independent = np.where(flipped, pair_idx[:, 0], pair_idx[:, 1])
+        self._fit_spreads(dependent[survivors], independent[survivors],
+                          index=survivors)
+        self._spread_keys = None
+
+        self.pairs_df = pairs_df
+        self.filtered_pairs = filtered_pairs
+        self._filter_params = None
+        self._staged_params = {'max_pvalue': max_pvalue,
+                               'max_hurst_exp': max_hurst_exp,
+                               'max_half_life': max_half_life,
+                               'min_half_life': min_half_life,
+                               'min_avg_cross': min_avg_cross,
+                               'min_correlation': min_correlation,
+                               'trading_year': trading_year,
+                               'lags': lags,
+                               **eg_kwargs}
+        self.stage_counts = pd.Series(stage_counts)
+
+        for stage, count in self.stage_counts.items():
+            print(f"{stage}: {count} pairs")
+
+    def _summarize_pairs(self):
+        """
+        Generates a summary dataframe of potential pairs and their
+        statistics.
+        """
+
         pairs_df = pd.concat([self.pairs,
                               self.engle_granger_tests,
                               self.hurst_exponents,
@@ -319,8 +1882,21 @@ class OpticsPairs:
                             'half_life',
                             'avg_cross_count']
 
-        # Find pairs that meet user defined criteria
-        filtered_pairs = pairs_df.loc[
+        return pairs_df
+
+    @staticmethod
+    def _meets_criteria(pairs_df: pd.DataFrame,
+                        max_pvalue: float,
+                        max_hurst_exp: float,
+                        max_half_life: float,
+                        min_half_life: float,
+                        min_avg_cross: float):
+        """
+        Returns a boolean mask of pairs in pairs_df that meet user defined
+        criteria. See .filter_pairs() for parameters.
+        """
+
+        return (
             # Significant Engle-Grange test AND
             (pairs_df['pvalue'] <= max_pvalue) &
             # Mean reverting according to Hurst exponent AND
@@ -330,16 +1906,265 @@ class OpticsPairs:
             ((pairs_df['half_life'] >= min_half_life) &
              (pairs_df['half_life'] <= max_half_life)) &
             # Produces sufficient number of trading opportunities
-            (pairs_df['avg_cross_count'] >= min_avg_cross)]
+            (pairs_df['avg_cross_count'] >= min_avg_cross))
 
-        self.pairs_df = pairs_df
-        self.filtered_pairs = filtered_pairs
+    def profile_report(self):
+        """
+        Returns a dataframe with one row per profiled stage run. Profiling
+        must be enabled with OpticsPairs(profile=True).
+        """
 
-        if len(self.filtered_pairs) == 0:
-            print("No tradable pairs found. Try relaxing criteria.")
+        columns = ['stage', 'wall_time_s', 'cpu_time_s', 'peak_memory_mb',
+                   'n_securities', 'n_obs', 'n_items']
+
+        return pd.DataFrame(self.profile_records, columns=columns)
+
+    def save(self, path: str, spreads: bool = False):
+        """
+        Saves the fitted model to a directory of .npy arrays and a small
+        meta.json: prices, PCA components, cluster labels, pairs, pair
+        statistics, hedge ratios, OU parameters, the filtered pairs and
+        optionally the normalized spreads, along with the stage arguments
+        .update() reuses. Pairs are stored as column positions of their
+        securities, so no dataframe is pickled. Reload with
+        OpticsPairs.load().
+
+        :param path: A string path of the directory to write.
+        :param spreads: A boolean to denote whether self.norm_spreads is
+            saved. Default value is False.
+        """
+
+        if self.pairs is None:
+            raise ValueError("pairs not found: must run .find_pairs() \
+                             before this function")
+
+        os.makedirs(path, exist_ok=True)
+
+        def save_array(name, values):
+            np.save(os.path.join(path, name + '.npy'), values,
+                    allow_pickle=False)
+
+        index = self.prices.index
+        meta = {'securities': [str(s) for s in self.securities],
+                'n_components_': self.n_components_,
+                'statistics': [],
+                'arrays': [],
+                'index_tz': str(getattr(index, 'tz', None) or '') or None}
+
+        if index.dtype.kind in 'iufM':
+            save_array('prices_index', np.asarray(index.tz_localize(None)
+                                                  if meta['index_tz']
+                                                  else index))
         else:
-            n_pairs = len(self.filtered_pairs)
-            print(f"Found {n_pairs} tradable pairs!")
+            meta['prices_index'] = [str(i) for i in index]
+
+        labels = self.pairs.index.values.astype(np.int64)
+        save_array('prices', np.ascontiguousarray(self.prices.values))
+        save_array('pair_labels', labels)
+        save_array('pair_idx', self._pair_positions())
+        save_array('cluster_labels', np.asarray(self.cluster_labels))
+
+        if self.components_ is not None:
+            save_array('components', self.components_)
+            save_array('explained_variance_ratio',
+                       self.explained_variance_ratio_)
+            meta['arrays'].append('components')
+
+        if self._cluster_components is not None:
+            save_array('cluster_components', self._cluster_components)
+            meta['arrays'].append('cluster_components')
+
+        # Statistics aligned to the pairs, NaN for pairs without a value
+        statistics = [name for name in OpticsPairs._SAVED_STATISTICS
+                      if getattr(self, name) is not None]
+        if len(statistics) > 0:
+            save_array('statistics', np.column_stack(
+                [getattr(self, name).reindex(self.pairs.index).values
+                 .astype(float) for name in statistics]))
+            meta['statistics'] = statistics
+
+        if self.hedge_ratios is not None:
+            columns = {security: i for i, security
+                       in enumerate(self.securities)}
+            save_array('hedge_labels',
+                       self.hedge_ratios.index.values.astype(np.int64))
+            save_array('hedge_idx', np.column_stack(
+                [self.hedge_ratios['dependent'].map(columns).values,
+                 self.hedge_ratios['independent'].map(columns).values]))
+            save_array('hedge_params',
+                       self.hedge_ratios[['alpha', 'beta']].values)
+            meta['arrays'].append('hedge_ratios')
+
+        if self.ou_params is not None:
+            save_array('ou_labels', self.ou_params.index.values
+                       .astype(np.int64))
+            save_array('ou_params',
+                       self.ou_params[['theta', 'mu', 'sigma']].values)
+            meta['arrays'].append('ou_params')
+
+        if self.filtered_pairs is not None:
+            save_array('filtered_labels',
+                       self.filtered_pairs.index.values.astype(np.int64))
+            meta['arrays'].append('filtered_pairs')
+
+        if spreads and self.norm_spreads is not None:
+            # Column-major order is kept so each spread stays contiguous
+            save_array('norm_spreads', self.norm_spreads.values)
+            save_array('spread_labels',
+                       self.norm_spreads.columns.values.astype(np.int64))
+            meta['arrays'].append('norm_spreads')
+
+        # Stage arguments reused by .update(), None if not JSON serializable
+        pca_params = None
+        if (self._pca_params is not None and
+                type(self._pca_params['Scaler']) is StandardScaler):
+            pca_params = dict(self._pca_params)
+            pca_params['Scaler'] = pca_params['Scaler'].get_params()
+        cluster_params = None
+        if (self._cluster_params is not None and
+                self._cluster_params['clustering'] is None):
+            cluster_params = self._cluster_params
+
+        meta['params'] = {
+            'pca': OpticsPairs._json_params(pca_params),
+            'cluster': OpticsPairs._json_params(cluster_params),
+            'recluster': OpticsPairs._json_params(self._recluster_params),
+            'filter': OpticsPairs._json_params(self._filter_params),
+            'staged': OpticsPairs._json_params(self._staged_params),
+            'hurst': OpticsPairs._json_params(self._hurst_params),
+            'trading_year': self._trading_year,
+            'ou_dt': self._ou_dt}
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    @staticmethod
+    def _json_params(params: dict):
+        """
+        Returns a copy of stage arguments that can be stored in JSON, with
+        dtypes as strings, or None if any argument cannot be stored.
+        """
+
+        if params is None:
+            return None
+
+        params = {key: (np.dtype(value).str
+                        if key == 'dtype' and value is not None else value)
+                  for key, value in params.items()}
+
+        def default(value):
+            if isinstance(value, (np.generic, np.ndarray)):
+                return value.tolist()
+            raise TypeError(f"{type(value)} is not JSON serializable")
+
+        try:
+            return json.loads(json.dumps(params, default=default))
+        except (TypeError, ValueError):
+            return None
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = 'r', **kwargs):
+        """
+        Loads a model saved with .save(). Prices and normalized spreads
+        are memory-mapped rather than read, and returns are only calculated
+        once a stage needs them, so loading does not depend on their size.
+        Stage arguments are restored so .update() can continue the model,
+        unless they could not be stored, e.g. a custom Scaler or
+        clustering estimator. Returns an OpticsPairs instance with the saved
+        attributes set.
+
+        :param path: A string path of the directory written by .save().
+        :param mmap_mode: Memory-map mode of the large arrays, see
+            np.load. 'r' is read-only. None reads them into memory.
+            Default value is 'r'.
+        :param kwargs: Keyword arguments for OpticsPairs(), e.g. cache.
+        """
+
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        def load_array(name, mmap=None):
+            return np.load(os.path.join(path, name + '.npy'),
+                           mmap_mode=mmap, allow_pickle=False)
+
+        securities = pd.Index(meta['securities'])
+        if 'prices_index' in meta:
+            index = pd.Index(meta['prices_index'])
+        else:
+            index = pd.Index(load_array('prices_index'))
+            if meta['index_tz']:
+                index = index.tz_localize(meta['index_tz'])
+
+        prices = pd.DataFrame(load_array('prices', mmap_mode), index=index,
+                              columns=securities, copy=False)
+        op = cls(prices, **kwargs)
+
+        labels = pd.Index(load_array('pair_labels'))
+        pair_idx = load_array('pair_idx')
+        op.pairs = pd.Series(list(zip(securities[pair_idx[:, 0]],
+                                      securities[pair_idx[:, 1]])),
+                             index=labels, dtype=object)
+        op.cluster_labels = load_array('cluster_labels')
+
+        if 'components' in meta['arrays']:
+            op.components_ = load_array('components')
+            op.explained_variance_ratio_ = \
+                load_array('explained_variance_ratio')
+            op.n_components_ = meta['n_components_']
+
+        if 'cluster_components' in meta['arrays']:
+            op._cluster_components = load_array('cluster_components')
+
+        params = meta.get('params', {})
+        for name in ['cluster', 'recluster', 'filter', 'staged', 'hurst']:
+            values = params.get(name)
+            if values is not None and values.get('dtype') is not None:
+                values['dtype'] = np.dtype(values['dtype'])
+            setattr(op, f'_{name}_params', values)
+
+        if params.get('pca') is not None:
+            op._pca_params = params['pca']
+            op._pca_params['Scaler'] = StandardScaler(
+                **op._pca_params['Scaler'])
+            if op._pca_params.get('dtype') is not None:
+                op._pca_params['dtype'] = np.dtype(op._pca_params['dtype'])
+            # Unfitted, only marks that PCA can be updated from moments
+            op._scaler = StandardScaler()
+
+        op._trading_year = params.get('trading_year', op._trading_year)
+        op._ou_dt = params.get('ou_dt', op._ou_dt)
+
+        if len(meta['statistics']) > 0:
+            statistics = load_array('statistics')
+            for i, name in enumerate(meta['statistics']):
+                setattr(op, name, pd.Series(statistics[:, i], index=labels))
+
+        if 'hedge_ratios' in meta['arrays']:
+            hedge_idx = load_array('hedge_idx')
+            alpha, beta = load_array('hedge_params').T
+            op.hedge_ratios = op._hedge_ratio_frame(
+                hedge_idx[:, 0], hedge_idx[:, 1], alpha, beta,
+                index=pd.Index(load_array('hedge_labels')))
+
+        if 'ou_params' in meta['arrays']:
+            op.ou_params = pd.DataFrame(
+                load_array('ou_params'),
+                index=pd.Index(load_array('ou_labels')),
+                columns=['theta', 'mu', 'sigma'])
+            op.ou_params['half_life'] = np.log(2)/op.ou_params['theta']
+
+        if len(meta['statistics']) == len(OpticsPairs._SAVED_STATISTICS):
+            op.pairs_df = op._summarize_pairs()
+            if 'filtered_pairs' in meta['arrays']:
+                op.filtered_pairs = op.pairs_df.loc[
+                    load_array('filtered_labels')]
+
+        if 'norm_spreads' in meta['arrays']:
+            op.norm_spreads = pd.DataFrame(
+                load_array('norm_spreads', mmap_mode), index=index,
+                columns=pd.Index(load_array('spread_labels')), copy=False)
+
+        return op
 
     def plot_pair_price_spread(self, idx: int):
         """
@@ -488,28 +2313,92 @@ class OpticsPairs:
             warnings.warn("Cannot visualize more than three dimensions!")
 
     @staticmethod
-    def hurst(norm_spread):
+    def hurst(norm_spread, lags=None):
         """
         Calculates Hurst exponent.
         https://en.wikipedia.org/wiki/Hurst_exponent
 
         :param norm_spread: An array like object used to calculate half-life.
+        :param lags: An iterable of integer lags. Default is range(2, 100).
+        """
+
+        return OpticsPairs.hurst_matrix(norm_spread, lags=lags)[0]
+
+    @staticmethod
+    def hurst_matrix(norm_spreads,
+                     lags=None,
+                     dtype=np.float64,
+                     block_size: int = 256):
         """
+        Calculates the Hurst exponent of every column of a TxP array.
+        For each lag, the variance of the lagged differences is computed
+        for a block of columns in one preallocated buffer, instead of
+        keeping an array per lag and series.
+
+        :param norm_spreads: A TxP array like object of spreads.
+        :param lags: An iterable of integer lags. Default is range(2, 100).
+        :param dtype: Data type of the working buffer. Sums are always
+            accumulated in float64.
+        :param block_size: An integer to denote the number of columns
+            processed at once. Only one block is read from a memory-mapped
+            array at a time.
+        """
+
+        spreads = np.asarray(norm_spreads)
+        if spreads.ndim == 1:
+            spreads = spreads[:, np.newaxis]
+
         # Create the range of lag values
-        lags = range(2, 100)
+        lags = np.arange(2, 100) if lags is None else np.asarray(lags, int)
+
+        n_obs, n_series = spreads.shape
+        log_tau = np.empty((len(lags), n_series))
+        buffer = np.empty((n_obs, min(block_size, n_series)), dtype=dtype)
+
+        for start in range(0, n_series, block_size):
+            block = spreads[:, start:start + block_size].astype(dtype,
+                                                                copy=False)
+            width = block.shape[1]
+
+            for i, lag in enumerate(lags):
+                n_diff = n_obs - lag
 
-        # Calculate the array of the variances of the lagged differences
-        diffs = [np.subtract(norm_spread[l:], norm_spread[:-l]) for l in lags]
-        tau = [np.sqrt(np.std(diff)) for diff in diffs]
+                # Mean of lagged differences from the head and tail sums
+                mean = (block[n_diff:].sum(axis=0, dtype=np.float64) -
+                        block[:lag].sum(axis=0, dtype=np.float64))/n_diff
+
+                # Mean square of lagged differences in the working buffer
+                diff = buffer[:n_diff, :width]
+                np.subtract(block[lag:], block[:-lag], out=diff)
+                np.square(diff, out=diff)
+                mean_sq = diff.sum(axis=0, dtype=np.float64)/n_diff
+
+                # tau = sqrt(std) = var**0.25
+                var = np.maximum(mean_sq - mean**2, 0.0)
+                log_tau[i, start:start + width] = 0.25*np.log(var)
 
         # Use a linear fit to estimate the Hurst Exponent
-        poly = np.polyfit(np.log(lags), np.log(tau), 1)
+        poly = np.polyfit(np.log(lags), log_tau, 1)
 
         # Return the Hurst exponent from the polyfit output
         H = poly[0]*2.0
 
         return H
 
+    @staticmethod
+    def log_lags(min_lag: int = 2, max_lag: int = 100, n_lags: int = 20):
+        """
+        Returns a log-spaced grid of unique integer lags for the Hurst
+        exponent.
+
+        :param min_lag: An integer to denote the smallest lag.
+        :param max_lag: An integer to denote the largest lag.
+        :param n_lags: An integer to denote the number of grid points
+            before duplicates are removed.
+        """
+
+        return np.unique(np.geomspace(min_lag, max_lag, n_lags).astype(int))
+
     @staticmethod
     def half_life(norm_spread):
         """
@@ -518,17 +2407,99 @@ class OpticsPairs:
 
         :param norm_spread: An array like object used to calculate half-life.
         """
-        lag = norm_spread.shift(1)
-        lag[0] = lag[1]
 
-        ret = norm_spread - lag
-        lag = sm.add_constant(lag)
+        return OpticsPairs.half_life_matrix(norm_spread)[0]
+
+    @staticmethod
+    def half_life_matrix(norm_spreads):
+        """
+        Calculates the half-life of every column of a TxP array from the
+        closed-form AR(1) slope of the differences on the lagged level.
+
+        :param norm_spreads: A TxP array like object of spreads.
+        """
 
-        model = sm.OLS(ret, lag)
-        result = model.fit()
-        half_life = -np.log(2)/result.params.iloc[1]
+        spreads = np.asarray(norm_spreads, dtype=float)
+        if spreads.ndim == 1:
+            spreads = spreads[:, np.newaxis]
 
-        return half_life
+        # Lagged level, with the first value repeated to keep length T
+        lag = np.concatenate([spreads[:1], spreads[:-1]])
+        ret = spreads - lag
+
+        # OLS slope of ret on a constant and lag
+        lag_dev = lag - lag.mean(axis=0)
+        slope = ((lag_dev*(ret - ret.mean(axis=0))).sum(axis=0) /
+                 (lag_dev**2).sum(axis=0))
+
+        return -np.log(2)/slope
+
+    @staticmethod
+    def ou_fit_matrix(spreads, dt: float = 1.0, window: int = None):
+        """
+        Fits an Ornstein-Uhlenbeck process dX = theta*(mu - X)dt + sigma*dW
+        to every column of a TxP array by exact maximum likelihood. The
+        discretized process is the AR(1) X[t+1] = a + b*X[t] + e, so the
+        fit reduces to closed-form sums over all columns at once:
+            theta = -ln(b)/dt
+            mu = a/(1 - b)
+            sigma = std(e)*sqrt(2*theta/(1 - b**2))
+        Columns with b outside (0, 1) are not mean-reverting and get NaN.
+        Returns theta, mu and sigma.
+
+        :param spreads: A TxP array like object of spreads.
+        :param dt: A float to denote the time step between observations.
+            Default value is 1.0.
+        :param window: Optional integer number of observations per fit.
+            If given, parameters are fitted over every rolling window from
+            cumulative sums and each output is a (T-window+1)xP array
+            whose row i covers spreads[i:i + window].
+        """
+
+        spreads = np.asarray(spreads, dtype=float)
+        if spreads.ndim == 1:
+            spreads = spreads[:, np.newaxis]
+
+        # Centre columns so cumulative sums do not lose precision
+        centre = spreads.mean(axis=0)
+        spreads = spreads - centre
+        x, y = spreads[:-1], spreads[1:]
+
+        if window is None:
+            n = len(x)
+            sums = [v.sum(axis=0) for v in [x, y, x*x, x*y, y*y]]
+        else:
+            if window < 3 or window > len(spreads):
+                raise ValueError("window must be between 3 and the number \
+                                 of observations")
+            n = window - 1
+
+            # Sums over each window of n transitions as differences of
+            # cumulative sums
+            sums = []
+            for v in [x, y, x*x, x*y, y*y]:
+                cumsum = np.concatenate([np.zeros((1, v.shape[1])),
+                                         np.cumsum(v, axis=0)])
+                sums.append(cumsum[n:] - cumsum[:-n])
+
+        sx, sy, sxx, sxy, syy = sums
+        sxx_dev = sxx - sx*sx/n
+        sxy_dev = sxy - sx*sy/n
+        syy_dev = syy - sy*sy/n
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            b = sxy_dev/sxx_dev
+            a = (sy - b*sx)/n
+            resid_var = np.maximum(syy_dev - b*sxy_dev, 0.0)/n
+
+            reverting = (b > 0) & (b < 1)
+            b = np.where(reverting, b, np.nan)
+
+            theta = -np.log(b)/dt
+            mu = a/(1 - b) + centre
+            sigma = np.sqrt(resid_var*2*theta/(1 - b**2))
+
+        return theta, mu, sigma
 
     @staticmethod
     def count_crosses(norm_spread, mean: float = 0.0):
@@ -540,17 +2511,118 @@ class OpticsPairs:
             Default value is 0.0.
         """
 
-        curr_period = norm_spread
-        next_period = norm_spread.shift(-1)
-        count = (
-            ((curr_period >= mean) & (next_period < mean)) |  # Over to under
-            ((curr_period < mean) & (next_period >= mean)) |  # Under to over
-            (curr_period == mean)
-        ).sum()
+        return OpticsPairs.count_crosses_matrix(norm_spread, mean)[0]
+
+    @staticmethod
+    def count_crosses_matrix(norm_spreads, mean: float = 0.0):
+        """
+        Calculates the number of times every column of a TxP array
+        crosses its mean by counting sign changes between periods.
+
+        :param norm_spreads: A TxP array like object of spreads.
+        :param mean: A float to denote mean of norm_spreads.
+            Default value is 0.0.
+        """
+
+        spreads = np.asarray(norm_spreads)
+        if spreads.ndim == 1:
+            spreads = spreads[:, np.newaxis]
+
+        over = spreads >= mean
+        under = spreads < mean
+        at_mean = spreads == mean
+
+        crosses = (
+            (over[:-1] & under[1:]) |  # Over to under
+            (under[:-1] & over[1:]) |  # Under to over
+            at_mean[:-1]
+        ).sum(axis=0)
+
+        # Last period has no next period, only count it if at the mean
+        return crosses + at_mean[-1]
+
+    @staticmethod
+    def spread_statistics(spreads, normalize: bool = True):
+        """
+        Columnar kernel over a TxP spread array. Returns the normalized
+        spreads, half-lives and mean cross counts, each computed in one
+        vectorized pass over all columns.
+
+        :param spreads: A TxP array like object of spreads.
+        :param normalize: A boolean to denote whether spreads are z-scored
+            first. Set to False if spreads are already normalized.
+        """
 
-        return count
+        spreads = np.asarray(spreads, dtype=float)
+        if spreads.ndim == 1:
+            spreads = spreads[:, np.newaxis]
+
+        if normalize:
+            spreads = OpticsPairs.calc_zscore(spreads)
+
+        half_lives = OpticsPairs.half_life_matrix(spreads)
+        cross_counts = OpticsPairs.count_crosses_matrix(spreads)
+
+        return spreads, half_lives, cross_counts
+
+    @staticmethod
+    def rolling_zscore_matrix(spreads, windows):
+        """
+        Calculates rolling z-scores of every column of a TxP array over K
+        lookback windows in one pass. Rolling sums come from differences of
+        cumulative sums, so the cost does not grow with the window length.
+        Returns a KxTxP array, NaN before a full window and for NaN
+        windows. Standard deviations use ddof=0.
+
+        :param spreads: A TxP array like object of spreads.
+        :param windows: An array of K lookbacks shared by all columns, or a
+            KxP array with a lookback per window and column.
+        """
+
+        spreads = np.asarray(spreads, dtype=float)
+        if spreads.ndim == 1:
+            spreads = spreads[:, np.newaxis]
+        n_obs, n_cols = spreads.shape
+
+        windows = np.asarray(windows, dtype=float)
+        if windows.ndim == 1:
+            windows = np.repeat(windows[:, np.newaxis], n_cols, axis=1)
+        invalid = np.isnan(windows)
+        windows = np.where(invalid, 1, windows).astype(int)
+
+        # Centre columns so cumulative sums do not lose precision
+        spreads = spreads - spreads.mean(axis=0)
+        zero = np.zeros((1, n_cols))
+        cumsum = np.concatenate([zero, np.cumsum(spreads, axis=0)])
+        cumsum_sq = np.concatenate([zero, np.cumsum(spreads**2, axis=0)])
+
+        zscores = np.full((len(windows), n_obs, n_cols), np.nan)
+        end = np.arange(1, n_obs + 1)[:, np.newaxis]
+
+        for k, window in enumerate(windows):
+            # Row of the cumulative sums just before each window
+            begin = np.maximum(end - window, 0)
+            total = cumsum[1:] - np.take_along_axis(cumsum, begin, axis=0)
+            total_sq = (cumsum_sq[1:] -
+                        np.take_along_axis(cumsum_sq, begin, axis=0))
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = total/window
+                std = np.sqrt(np.maximum(total_sq/window - mean**2, 0.0))
+                zscore = (spreads - mean)/std
+
+            full = (end >= window) & ~invalid[k]
+            zscores[k][full] = zscore[full]
+
+        return zscores
 
     @staticmethod
     def calc_zscore(spread):
-        zscore = (spread - np.mean(spread))/np.std(spread)
+        """
+        Normalizes a spread, or each column of a TxP spread array, to
+        zero mean and unit standard deviation.
+
+        :param spread: An array like object of spread values.
+        """
+        zscore = (spread - np.mean(spread, axis=0))/np.std(spread, axis=0)
         return zscore
@@ -0,0 +1,224 @@
+import pandas as pd
+import numpy as np
+
+from typing import *
+
+
+class SpreadMonitor:
+    """
+    Streaming evaluator of pair spreads and z-scores.
+
+    Holds the fitted hedge ratios of many pairs, the latest price of every
+    leg and a ring buffer of each pair's last `window` spreads with running
+    sums. A price tick for one security updates the spread, rolling mean,
+    rolling standard deviation and z-score of only the pairs that trade it,
+    in constant time per pair regardless of the length of history.
+    """
+
+    def __init__(self, hedge_ratios: pd.DataFrame, window: int):
+        """
+        :param hedge_ratios: pd.DataFrame with columns dependent,
+            independent, alpha and beta, e.g. OpticsPairs.hedge_ratios.
+            The spread of a pair is dependent - (alpha + beta*independent).
+        :param window: An integer to denote the number of spread
+            observations in the rolling mean and standard deviation.
+        """
+
+        self.window = window
+        self.pairs = hedge_ratios.index
+        self.dependent = hedge_ratios['dependent'].values
+        self.independent = hedge_ratios['independent'].values
+        self.alpha = hedge_ratios['alpha'].values.astype(float)
+        self.beta = hedge_ratios['beta'].values.astype(float)
+
+        n_pairs = len(hedge_ratios)
+        self.dependent_price = np.full(n_pairs, np.nan)
+        self.independent_price = np.full(n_pairs, np.nan)
+        self.spread = np.full(n_pairs, np.nan)
+        self.zscore = np.full(n_pairs, np.nan)
+
+        # Ring buffer of spreads and running sums per pair
+        self._buffer = np.zeros((n_pairs, window))
+        self._position = np.zeros(n_pairs, dtype=int)
+        self._count = np.zeros(n_pairs, dtype=int)
+        self._sum = np.zeros(n_pairs)
+        self._sum_sq = np.zeros(n_pairs)
+
+        # Rows of the pairs each security is a leg of
+        self._dependent_rows = SpreadMonitor._rows_by_security(
+            self.dependent)
+        self._independent_rows = SpreadMonitor._rows_by_security(
+            self.independent)
+        self._rows = {
+            security: np.union1d(
+                self._dependent_rows.get(security, []),
+                self._independent_rows.get(security, [])).astype(int)
+            for security in set(self.dependent) | set(self.independent)}
+
+    @classmethod
+    def from_optics_pairs(cls, op, window: int, pairs=None):
+        """
+        Creates a monitor for pairs of a fitted OpticsPairs instance and
+        warms it up with the last `window` spreads of its prices.
+
+        :param op: OpticsPairs instance after .calc_eg_norm_spreads() or
+            .filter_pairs_staged().
+        :param window: An integer to denote the rolling window length.
+        :param pairs: Optional index of pair labels to monitor. Default is
+            op.filtered_pairs.index, or every pair if pairs are not
+            filtered yet.
+        """
+
+        if op.hedge_ratios is None:
+            raise ValueError("hedge_ratios not found: must run \
+                             .calc_eg_norm_spreads() before this function")
+
+        if pairs is None:
+            pairs = (op.hedge_ratios.index if op.filtered_pairs is None
+                     else op.filtered_pairs.index)
+
+        monitor = cls(op.hedge_ratios.loc[pairs], window)
+        monitor.warm_up(op.prices.iloc[-window:])
+
+        return monitor
+
+    def warm_up(self, prices: pd.DataFrame):
+        """
+        Fills the rolling windows from a dataframe of historical prices,
+        one row per bar, replacing any previous state.
+
+        :param prices: pd.DataFrame with a column for every leg.
+        """
+
+        history = prices.iloc[-self.window:]
+        spreads = (history[self.dependent].values -
+                   (self.alpha + self.beta*history[self.independent].values))
+
+        n_obs = len(history)
+        self._buffer[:] = 0.0
+        self._buffer[:, :n_obs] = spreads.T
+        self._position[:] = n_obs % self.window
+        self._count[:] = n_obs
+        self._sum = self._buffer.sum(axis=1)
+        self._sum_sq = (self._buffer**2).sum(axis=1)
+
+        self.dependent_price = history[self.dependent].values[-1].astype(float)
+        self.independent_price = \
+            history[self.independent].values[-1].astype(float)
+        self.spread = spreads[-1]
+        self.zscore = self._zscore(np.arange(len(self.pairs)))
+
+    def update(self, security: str, price: float, push: bool = True):
+        """
+        Updates the spread and z-score of every pair with security as a
+        leg. Returns the row positions of the updated pairs and their
+        z-scores; self.pairs[rows] gives their labels.
+
+        :param security: A string identifier of the security that ticked.
+        :param price: A float of its latest price.
+        :param push: A boolean to denote whether the new spreads are added
+            to the rolling windows. If False, spreads are only evaluated
+            against the current rolling mean and standard deviation, e.g.
+            for intra-bar ticks. Default value is True.
+        """
+
+        rows = self._rows.get(security)
+        if rows is None:
+            return np.empty(0, dtype=int), np.empty(0)
+
+        self.dependent_price[self._dependent_rows.get(security, [])] = price
+        self.independent_price[
+            self._independent_rows.get(security, [])] = price
+
+        spread = (self.dependent_price[rows] -
+                  (self.alpha[rows] + self.beta[rows] *
+                   self.independent_price[rows]))
+        self.spread[rows] = spread
+
+        if push:
+            # Pairs missing a leg price have no spread to add yet
+            self._push(rows[~np.isnan(spread)], spread[~np.isnan(spread)])
+
+        zscore = self._zscore(rows)
+        self.zscore[rows] = zscore
+
+        return rows, zscore
+
+    def update_bar(self, prices: pd.Series):
+        """
+        Adds one bar for every pair from a series of closing prices, for
+        candle feeds. Legs missing from prices keep their last price.
+        Returns the z-scores of every pair.
+
+        :param prices: pd.Series of prices indexed by security.
+        """
+
+        for security, price in prices.items():
+            self.dependent_price[self._dependent_rows.get(security, [])] = \
+                price
+            self.independent_price[
+                self._independent_rows.get(security, [])] = price
+
+        self.spread = (self.dependent_price -
+                       (self.alpha + self.beta*self.independent_price))
+
+        rows = np.flatnonzero(~np.isnan(self.spread))
+        self._push(rows, self.spread[rows])
+        self.zscore = self._zscore(np.arange(len(self.pairs)))
+
+        return self.zscore
+
+    def zscores(self) -> pd.DataFrame:
+        """
+        Returns a snapshot of the latest spread, rolling mean, rolling
+        standard deviation and z-score of every pair.
+        """
+
+        rows = np.arange(len(self.pairs))
+        mean, std = self._mean_std(rows)
+
+        return pd.DataFrame({'spread': self.spread,
+                             'mean': mean,
+                             'std': std,
+                             'zscore': self.zscore},
+                            index=self.pairs)
+
+    def _push(self, rows: np.ndarray, spread: np.ndarray):
+
+        position = self._position[rows]
+        full = self._count[rows] == self.window
+        old = np.where(full, self._buffer[rows, position], 0.0)
+
+        self._sum[rows] += spread - old
+        self._sum_sq[rows] += spread**2 - old**2
+        self._buffer[rows, position] = spread
+        self._position[rows] = (position + 1) % self.window
+        self._count[rows] = np.minimum(self._count[rows] + 1, self.window)
+
+        # Recompute sums once per full window to stop rounding drift,
+        # which keeps the cost per tick O(1) amortized
+        wrapped = rows[self._position[rows] == 0]
+        if len(wrapped) > 0:
+            self._sum[wrapped] = self._buffer[wrapped].sum(axis=1)
+            self._sum_sq[wrapped] = (self._buffer[wrapped]**2).sum(axis=1)
+
+    def _mean_std(self, rows: np.ndarray):
+
+        count = self._count[rows]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self._sum[rows]/count
+            var = self._sum_sq[rows]/count - mean**2
+
+        return mean, np.sqrt(np.maximum(var, 0.0))
+
+    def _zscore(self, rows: np.ndarray):
+
+        mean, std = self._mean_std(rows)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (self.spread[rows] - mean)/std
+
+    @staticmethod
+    def _rows_by_security(securities: np.ndarray) -> Dict[str, np.ndarray]:
+
+        rows = pd.Series(np.arange(len(securities))).groupby(securities)
+        return {security: group.values for security, group in rows}
@@ -7,6 +7,9 @@ from typing import Dict
 TF_EQUIV = {"1m": "1Min", "5m": "5Min", "15m": "15Min", "30m": "30Min",
             "1h": "1H", "4h": "4H", "12h": "12H", "1d": "D"}
 
+TF_MS = {"1m": 60000, "5m": 300000, "15m": 900000, "30m": 1800000,
+         "1h": 3600000, "4h": 14400000, "12h": 43200000, "1d": 86400000}
+
 DAYS_TO_TF = {
     "1m": {1: 1440, 2: 2880, 3: 4320, 4: 5760, 5: 7200},
     "5m": {1: 288, 2: 576, 3: 864, 4: 1152, 5: 1440},
@@ -0,0 +1,204 @@
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+import warnings
+
+from mlpairs import OpticsPairs
+
+
+# Read-only views of the shared price and return arrays in each worker
+_shared = {}
+
+
+def _attach_shared(prices_name: str,
+                   returns_name: str,
+                   shape: tuple,
+                   index: pd.Index,
+                   columns: pd.Index):
+    """
+    Worker initializer. Attaches to the shared memory blocks created by
+    walk_forward and keeps read-only dataframe views of them.
+    """
+
+    for key, name, n_rows in [('prices', prices_name, shape[0]),
+                              ('returns', returns_name, shape[0] - 1)]:
+        shm = shared_memory.SharedMemory(name=name)
+        values = np.ndarray((n_rows, shape[1]), dtype=np.float64,
+                            buffer=shm.buf)
+        values.flags.writeable = False
+        _shared[key + '_shm'] = shm
+        _shared[key] = values
+
+    _shared['index'] = index
+    _shared['columns'] = columns
+
+
+def _run_shared_window(start: int, formation: int, params: dict):
+    """
+    Runs the pipeline on one formation window of the shared arrays.
+    """
+
+    return _run_window(_shared['prices'], _shared['returns'],
+                       _shared['index'], _shared['columns'],
+                       start, formation, params)
+
+
+def _run_window(prices: np.ndarray,
+                returns: np.ndarray,
+                index: pd.Index,
+                columns: pd.Index,
+                start: int,
+                formation: int,
+                params: dict):
+    """
+    Selects and filters pairs over prices[start:start + formation].
+    Returns for the window are sliced from the precomputed returns, which
+    exclude the first period of the panel.
+    """
+
+    stop = start + formation
+    window_prices = pd.DataFrame(prices[start:stop], index=index[start:stop],
+                                 columns=columns, copy=False)
+    window_returns = pd.DataFrame(returns[start:stop - 1],
+                                  index=index[start + 1:stop],
+                                  columns=columns, copy=False)
+
+    op = OpticsPairs(window_prices, returns=window_returns)
+    op.reduce_PCA(**params['pca_kwargs'])
+    op.find_pairs(**params['cluster_kwargs'])
+
+    if params['staged']:
+        op.filter_pairs_staged(**params['filter_kwargs'],
+                               **params['eg_kwargs'])
+    else:
+        op.calc_eg_norm_spreads(**params['eg_kwargs'])
+        op.calc_hurst_exponents()
+        op.calc_spread_statistics()
+        op.filter_pairs(**params['filter_kwargs'])
+
+    selected = op.filtered_pairs.copy()
+    selected.insert(0, 'formation_end', index[stop - 1])
+    selected.insert(0, 'formation_start', index[start])
+
+    return selected
+
+
+def walk_forward(prices: pd.DataFrame,
+                 formation: int,
+                 step: int,
+                 n_jobs: int = 1,
+                 pca_kwargs: dict = None,
+                 cluster_kwargs: dict = None,
+                 eg_kwargs: dict = None,
+                 filter_kwargs: dict = None,
+                 staged: bool = False) -> pd.DataFrame:
+    """
+    Runs the OpticsPairs selection and filtering pipeline over rolling
+    formation windows of a price panel.
+
+    Returns are calculated once for the whole panel. With n_jobs > 1 the
+    price and return arrays are placed in shared memory and every worker
+    process reads its windows from the same read-only buffers, so the
+    panel is not copied per window.
+
+    :param prices: pd.DataFrame of security prices with dimensions TxN.
+    :param formation: An integer to denote the number of bars per window.
+    :param step: An integer to denote the number of bars between the starts
+        of consecutive windows.
+    :param n_jobs: An integer to denote the number of worker processes.
+        -1 uses all available cores. Default value is 1 (serial).
+    :param pca_kwargs: Keyword arguments for OpticsPairs.reduce_PCA().
+    :param cluster_kwargs: Keyword arguments for OpticsPairs.find_pairs(),
+        e.g. {'algorithm': 'knn_graph', 'min_samples': 3}.
+    :param eg_kwargs: Keyword arguments for the Engle-Granger stage, e.g.
+        {'eg_lag': 'series'}. Each window runs its tests in its worker.
+    :param filter_kwargs: Keyword arguments for OpticsPairs.filter_pairs()
+        or OpticsPairs.filter_pairs_staged().
+    :param staged: A boolean to denote whether windows are filtered with
+        OpticsPairs.filter_pairs_staged(). Default value is False.
+
+    Returns a dataframe with one row per selected pair and window, with
+    the window's first and last bar, the window number, the pair and its
+    statistics.
+    """
+
+    if formation > len(prices):
+        raise ValueError("formation must not be longer than prices")
+
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+
+    params = {'pca_kwargs': pca_kwargs or {},
+              'cluster_kwargs': cluster_kwargs or {},
+              'eg_kwargs': eg_kwargs or {},
+              'filter_kwargs': filter_kwargs or {},
+              'staged': staged}
+
+    starts = list(range(0, len(prices) - formation + 1, step))
+
+    price_values = np.ascontiguousarray(prices.values, dtype=np.float64)
+    return_values = np.ascontiguousarray(
+        prices.pct_change().values[1:], dtype=np.float64)
+
+    results = [None]*len(starts)
+
+    if n_jobs == 1:
+        for i, start in enumerate(starts):
+            try:
+                results[i] = _run_window(price_values, return_values,
+                                         prices.index, prices.columns,
+                                         start, formation, params)
+            except Exception as e:
+                warnings.warn(f"Window starting at {prices.index[start]} "
+                              f"failed: {e!r}")
+    else:
+        blocks = []
+        try:
+            # Copy arrays into shared memory once for all workers
+            names = []
+            for values in [price_values, return_values]:
+                shm = shared_memory.SharedMemory(create=True,
+                                                 size=max(values.nbytes, 1))
+                np.ndarray(values.shape, dtype=np.float64,
+                           buffer=shm.buf)[:] = values
+                blocks.append(shm)
+                names.append(shm.name)
+
+            with ProcessPoolExecutor(
+                    max_workers=n_jobs,
+                    initializer=_attach_shared,
+                    initargs=(names[0], names[1], price_values.shape,
+                              prices.index, prices.columns)) as executor:
+                futures = [executor.submit(_run_shared_window, start,
+                                           formation, params)
+                           for start in starts]
+
+                for i, future in enumerate(futures):
+                    try:
+                        results[i] = future.result()
+                    except Exception as e:
+                        warnings.warn(f"Window starting at "
+                                      f"{prices.index[starts[i]]} "
+                                      f"failed: {e!r}")
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+    windows = []
+    for i, selected in enumerate(results):
+        if selected is None:
+            continue
+        selected = selected.reset_index(drop=True)
+        selected.insert(0, 'window', i)
+        windows.append(selected)
+
+    if len(windows) == 0:
+        return pd.DataFrame(columns=['window', 'formation_start',
+                                     'formation_end', 'pair', 'pvalue',
+                                     'hurst_exp', 'half_life',
+                                     'avg_cross_count'])
+
+    return pd.concat(windows, ignore_index=True)
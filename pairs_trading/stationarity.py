@@ -89,10 +89,12 @@ if plot_charts:
     plt.show()
 
 
-def check_for_stationarity(X, cutoff=0.01):
+def check_for_stationarity(X, cutoff=0.01, maxlag=None):
     # H_0 in adfuller is unit root exists (non-stationary)
     # We must observe significant p-value to convince ourselves that the series is stationary
-    pvalue = adfuller(X)[1]
+    # Passing maxlag fixes the lag order and skips the AIC lag search
+    autolag = 'AIC' if maxlag is None else None
+    pvalue = adfuller(X, maxlag=maxlag, autolag=autolag)[1]
     if pvalue < cutoff:
         print('p-value = ' + str(pvalue) + ' The series ' + X.name + ' is likely stationary.')
         return True